@@ -5,6 +5,8 @@ import os
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 SOUNDS_DIR = os.path.join(PROJECT_ROOT, 'sounds')
 IMAGES_DIR = os.path.join(PROJECT_ROOT, 'hexagram_images')
+INDEX_DIR = os.path.join(PROJECT_ROOT, 'timeline_index')
+CACHE_DIR = os.path.join(PROJECT_ROOT, 'cache')
 
 # Create directories if they don't exist
 os.makedirs(SOUNDS_DIR, exist_ok=True)
@@ -37,19 +39,12 @@ PLAY_AUDIO_LEVEL_5_LINE_ENABLED = True
 PLAY_AUDIO_LEVEL_6_ENABLED = False
 PLAY_AUDIO_LEVEL_6_LINE_ENABLED = False
 
-# Previous hexagram tracking
-previous_hexagrams = {
-	'level_1': None,
-	'level_2': None,
-	'level_3': None,
-	'level_4': None,
-	'level_5': None,
-	'level_1_line': None,
-	'level_2_line': None,
-	'level_3_line': None,
-	'level_4_line': None,
-	'level_5_line': None
-}
+# Mixer settings, a smaller buffer (in samples) starts sounds sooner
+AUDIO_MIXER_FREQUENCY = 44100
+AUDIO_MIXER_BUFFER = 512
+
+# Sound cues queued ahead of the transitions that trigger them
+AUDIO_CUE_LOOKAHEAD = 16
 
 # Initial zero datetime
 ZERO_DATETIME = datetime.datetime(2055, 7, 16)
@@ -58,6 +53,104 @@ ZERO_DATETIME = datetime.datetime(2055, 7, 16)
 VRCHAT_IP = "127.0.0.1"
 VRCHAT_PORT = 9000
 
+# Chatbox send rate limit. VRChat throttles the chatbox, so messages beyond
+# VRCHAT_SEND_RATE per second (after a burst of VRCHAT_SEND_BURST) wait,
+# and only the newest waiting message is sent.
+VRCHAT_SEND_RATE = 1 / 1.5
+VRCHAT_SEND_BURST = 2
+
+# Chatbox targets sharing one computed snapshot. Each is a dict with 'ip' and
+# 'port', and optionally 'page' (1 or 2, follows CURRENT_PAGE if left out),
+# 'rate' and 'burst' (default to the values above).
+VRCHAT_TARGETS = [
+	{'ip': VRCHAT_IP, 'port': VRCHAT_PORT},
+]
+
+# What to send to the targets: 'chatbox' text, avatar 'parameters', or 'both'
+VRCHAT_OUTPUT_MODE = 'chatbox'
+
+# Avatar parameters are named <prefix>L<level>, <prefix>L<level>Line and
+# <prefix>L<level>Phase. Changed values are sent at most every
+# AVATAR_PARAMETER_INTERVAL seconds, and all of them every
+# AVATAR_PARAMETER_KEEPALIVE seconds (0 to turn off).
+AVATAR_PARAMETER_PREFIX = "/avatar/parameters/Hex"
+AVATAR_PARAMETER_LEVELS = (1, 2, 3, 4, 5, 6)
+AVATAR_PARAMETER_INTERVAL = 0.1
+AVATAR_PARAMETER_KEEPALIVE = 10
+
+# Message layouts shared by the chatbox pages and the GUI text panel, one
+# template per line. See message_formatter.MessageLayout for the fields.
+MESSAGE_LAYOUTS = {
+	'page1': [
+		"Date: {date}",
+		"Days_to_0: {rounded_days}d{hours_to_zero}h",
+		"Change: {L3.next_total_hours:02d}:{L3.next_minutes:02d}:{L3.next_seconds:02d}",
+		"L 3: {L3.cycle_hours:.2f} {L3.cycle_name}, {L3.number}-{L3.first_name} - {L3.line}",
+		"L 4: {L4.cycle_days:.0f} d, {L4.number}-{L4.first_name} - {L4.line}",
+		"L 5: {L5.cycle_days:.0f} d, {L5.number}-{L5.first_name} - {L5.line}",
+	],
+	'page2': [
+		"L 1: {L1.cycle_seconds:.2f} s, {L1.number} - {L1.first_name}",
+		"L 2 change {L2.next_minutes:02d}:{L2.next_seconds:02d}",
+		"L 2: {L2.cycle_seconds:.2f} s, {L2.number} - {L2.first_name} - {L2.line}",
+		"L 3 change {L3.next_total_hours:02d}:{L3.next_minutes:02d}:{L3.next_seconds:02d}",
+		"L 3: {L3.cycle_hours:.2f} h, {L3.number} - {L3.first_name} - {L3.line}",
+	],
+	'gui': [
+		"Hexagrams for: {date} - {time}",
+		"Days to 0: {rounded_days_to_zero}",
+		"Zero Date: {zero_date}",
+		"Level 1: {L1.cycle_seconds:.4f} s, Hexagram {L1.number} - {L1.name}",
+		"Level 1 changes in: {L1.next_ms:03d}ms",
+		"Level 1: Moving Line: {L1.line}",
+		"Level 2: {L2.cycle_seconds} s, Hexagram {L2.number} - {L2.name}",
+		"Level 2 changes in: {L2.next_minutes:02d}:{L2.next_seconds:02d}",
+		"Level 2: Moving Line: {L2.line}",
+		"Level 3: {L3.cycle_hours:.2f} h, Hexagram {L3.number} - {L3.name}",
+		"Level 3 changes in: {L3.next_total_hours:02d}:{L3.next_minutes:02d}:{L3.next_seconds:02d}",
+		"Level 3: Moving Line: {L3.line}",
+		"Level 4: {L4.cycle_days:.2f} days, Hexagram {L4.number} - {L4.name}",
+		"Level 4 changes in: {L4.next_days:02d}:{L4.next_hours:02d}:{L4.next_minutes:02d}:{L4.next_seconds:02d}",
+		"Level 4: Moving Line: {L4.line}",
+		"Level 5: {L5.cycle_days:.2f} days, Hexagram {L5.number} - {L5.name}",
+		"Level 5 changes in: {L5.next_days:03d}d{L5.next_hours:02d}:{L5.next_minutes:02d}:{L5.next_seconds:02d}",
+		"Level 5: Moving Line: {L5.line}",
+		"Level 6: {L6.cycle_days:.2f} days, Hexagram {L6.number} - {L6.name}",
+		"Level 6 changes in: {L6.next_days:03d}d{L6.next_hours:02d}:{L6.next_minutes:02d}:{L6.next_seconds:02d}",
+		"Level 6: Moving Line: {L6.line}",
+	],
+}
+
+# Encoded OSC datagrams kept for repeated messages
+OSC_PACKET_CACHE_SIZE = 128
+
+# Update loop timing (seconds). Loops also wake on every hexagram and
+# moving line change, so these only bound how stale countdowns can get.
+GUI_REFRESH_INTERVAL = 0.05
+VRCHAT_SEND_INTERVAL = 2
+AUDIO_REFRESH_INTERVAL = 0.25  # How soon sound menu and zero date changes reach the cue queue
+
+# Live feed server ("host:port" or ":port", None to turn off). Snapshots go
+# out every LIVE_SERVER_INTERVAL seconds and at every change; a client that
+# falls more than LIVE_CLIENT_QUEUE_SIZE messages behind loses the oldest.
+LIVE_SERVER_ADDRESS = None
+LIVE_SERVER_INTERVAL = 0.25
+LIVE_CLIENT_QUEUE_SIZE = 4
+LIVE_CLIENT_SEND_BUFFER = 16384  # Bytes buffered per client before its queue fills
+
+# Snapshots waiting for the Tk thread, older ones are dropped when full
+GUI_QUEUE_SIZE = 2
+GUI_DRAIN_INTERVAL_MS = 10
+
+# Rewrite only the changed characters of the main text panel. Turn off to
+# compare frame render times (GUIManager.frame_stats) with full redraws.
+GUI_DIFF_RENDERING = True
+
+# Hexagram images are decoded this many at a time while Tk is idle. With the
+# atlas enabled they are loaded from a single cached sprite sheet instead.
+IMAGE_PRELOAD_BATCH = 8
+HEXAGRAM_IMAGE_ATLAS = False
+
 # GUI Theme colors
 DARK_THEME = {
 	'background': '#2e2e2e',
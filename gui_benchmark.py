@@ -0,0 +1,89 @@
+import argparse
+import datetime
+import tempfile
+import time
+from hexagram_calculator import HexagramCalculator
+from gui_manager import GUIManager
+import constants
+import message_formatter
+
+
+def benchmark(gui_manager, calculator, frames, step, diff_rendering):
+	"""
+	Renders consecutive frames through update_display and times each one,
+	including the redraw Tk does in its idle tasks. After every frame the
+	panel text is checked against a plain render of the same lines.
+	Returns:
+		(mean, max) Tk time per frame in milliseconds
+	"""
+	constants.GUI_DIFF_RENDERING = diff_rendering
+	gui_manager.rendered_lines.clear()
+	layout = message_formatter.get_layout('gui', calculator.cycles)
+	start = datetime.datetime.now()
+	times = []
+	for frame in range(frames):
+		time_to_zero = constants.ZERO_DATETIME - (start + datetime.timedelta(seconds=frame * step))
+		hexagrams = calculator.get_hexagrams(time_to_zero)
+		started = time.perf_counter()
+		gui_manager.update_display(hexagrams, time_to_zero)
+		gui_manager.root.update_idletasks()
+		times.append(time.perf_counter() - started)
+
+		expected = "".join(line + "\n" for line in layout.render_lines(hexagrams, time_to_zero))
+		shown = gui_manager.output_text.get("1.0", "end-1c")
+		if shown != expected:
+			raise AssertionError(f"Frame {frame} shows {shown!r} instead of {expected!r}")
+	return 1000 * sum(times) / len(times), 1000 * max(times)
+
+
+def check_atlas(gui_manager):
+	"""
+	Writes the hexagram atlas to a temporary cache directory, loads it back
+	and checks every image matches the one decoded from its GIF
+	Returns:
+		Number of images checked
+	"""
+	for number in range(1, 65):
+		gui_manager.load_hexagram_image(number)
+	decoded = dict(gui_manager.hexagram_images)
+	cache_dir = constants.CACHE_DIR
+	with tempfile.TemporaryDirectory() as temp_dir:
+		constants.CACHE_DIR = temp_dir
+		try:
+			gui_manager.save_hexagram_atlas()
+			gui_manager.hexagram_images.clear()
+			if not gui_manager.load_hexagram_atlas():
+				raise AssertionError("The atlas just written could not be loaded")
+		finally:
+			constants.CACHE_DIR = cache_dir
+	if sorted(gui_manager.hexagram_images) != sorted(decoded):
+		raise AssertionError("The atlas does not hold the same hexagrams as the GIFs")
+	for number, image in decoded.items():
+		loaded = gui_manager.hexagram_images[number]
+		if (loaded.width(), loaded.height()) != (image.width(), image.height()):
+			raise AssertionError(f"Hexagram {number} is {loaded.width()}x{loaded.height()} in the atlas, not {image.width()}x{image.height()}")
+		if loaded.tk.call(loaded, 'data') != image.tk.call(image, 'data'):
+			raise AssertionError(f"Hexagram {number} has different pixels in the atlas")
+	return len(decoded)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compare Tk time per frame of diff rendering and full redraws of the main text panel, checking the shown text and the image atlas")
+	parser.add_argument('--frames', type=int, default=2000, help="Frames rendered in each mode")
+	parser.add_argument('--step', type=float, default=constants.GUI_REFRESH_INTERVAL, help="Seconds between the times of consecutive frames")
+	args = parser.parse_args()
+
+	calculator = HexagramCalculator()
+	# Only the main window is needed, not sound or VRChat output
+	gui_manager = GUIManager(None, calculator, None)
+	gui_manager.root.after_cancel(gui_manager.drain_job)
+	gui_manager.root.update()
+	try:
+		print(f"Atlas: {check_atlas(gui_manager)} images match their GIFs")
+		# Warm up the layout cache and the widgets before timing
+		benchmark(gui_manager, calculator, 50, args.step, True)
+		for name, diff_rendering in (("Full redraw", False), ("Diff rendering", True)):
+			mean_ms, max_ms = benchmark(gui_manager, calculator, args.frames, args.step, diff_rendering)
+			print(f"{name}: mean {mean_ms:.3f} ms, max {max_ms:.3f} ms per frame over {args.frames} frames")
+	finally:
+		gui_manager.root.destroy()
\ No newline at end of file
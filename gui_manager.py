@@ -4,11 +4,63 @@ import datetime
 
 from datetime import timedelta
 import math
+import queue
+import threading
+import time
 import constants
+import message_formatter
 import webbrowser
 import os
 
 
+class FrameStats:
+	"""Frame pacing counters for the main display"""
+	def __init__(self):
+		self.frames = 0
+		self.dropped = 0
+		self.last_shown_at = None
+		self.total_interval = 0.0
+		self.max_interval = 0.0
+		self.total_latency = 0.0
+		self.max_latency = 0.0
+		self.total_render = 0.0
+		self.max_render = 0.0
+		# Frames are dropped on both the update thread and the Tk thread
+		self.drop_lock = threading.Lock()
+
+	def drop(self):
+		with self.drop_lock:
+			self.dropped += 1
+
+	def record(self, submitted_at, render_started_at, shown_at):
+		"""Record a frame computed at submitted_at and drawn from render_started_at to shown_at (perf_counter seconds)"""
+		render = shown_at - render_started_at
+		self.total_render += render
+		self.max_render = max(self.max_render, render)
+		latency = shown_at - submitted_at
+		self.total_latency += latency
+		self.max_latency = max(self.max_latency, latency)
+		if self.last_shown_at is not None:
+			interval = shown_at - self.last_shown_at
+			self.total_interval += interval
+			self.max_interval = max(self.max_interval, interval)
+		self.last_shown_at = shown_at
+		self.frames += 1
+
+	def summary(self):
+		"""Returns the counters with intervals and latencies in milliseconds"""
+		return {
+			'frames': self.frames,
+			'dropped': self.dropped,
+			'mean_interval_ms': 1000 * self.total_interval / max(self.frames - 1, 1),
+			'max_interval_ms': 1000 * self.max_interval,
+			'mean_latency_ms': 1000 * self.total_latency / max(self.frames, 1),
+			'max_latency_ms': 1000 * self.max_latency,
+			'mean_render_ms': 1000 * self.total_render / max(self.frames, 1),
+			'max_render_ms': 1000 * self.max_render
+		}
+
+
 class GUIManager:
 	def __init__(self, sound_manager, hexagram_calculator, vrchat_manager):
 		self.sound_manager = sound_manager
@@ -21,7 +73,13 @@ class GUIManager:
 		self.audio_playback_allowed = False
 		self.hexagram_images = {}  # Store loaded images
 		self.hexagram_labels = {}  # Store image labels
+		# Snapshots from the update thread, drained on the Tk thread
+		self.snapshot_queue = queue.Queue(maxsize=constants.GUI_QUEUE_SIZE)
+		self.frame_stats = FrameStats()
+		self.rendered_lines = {}  # Lines currently shown in each diff-rendered text widget
+		self.image_update_counts = {'configured': 0, 'skipped': 0}  # Image label updates done and avoided
 		self.setup_main_window()
+		self.drain_job = self.root.after(constants.GUI_DRAIN_INTERVAL_MS, self.drain_snapshots)
 
 	def setup_main_window(self):
 		self.root = tk.Tk()
@@ -75,6 +133,7 @@ class GUIManager:
 		self.setup_style()
 		self.create_widgets()
 		self.root.after(1000, self.enable_audio_playback)
+		self.root.after_idle(self.preload_hexagram_images)
 		
 		# Set initial window size and position
 		initial_width = 1280  # Increased from 1024 to 1280
@@ -126,10 +185,98 @@ class GUIManager:
 		self.update_button = ttk.Button(self.zero_date_frame, text="Update", command=self.update_zero_datetime)
 		self.update_button.pack(side=tk.LEFT, padx=5)
 
+	def preload_hexagram_images(self, next_number=1):
+		"""Decode the hexagram images a few at a time while Tk is idle, so no update has to load one"""
+		if next_number == 1 and constants.HEXAGRAM_IMAGE_ATLAS and self.load_hexagram_atlas():
+			return
+
+		last_number = min(next_number + constants.IMAGE_PRELOAD_BATCH - 1, 64)
+		for number in range(next_number, last_number + 1):
+			self.load_hexagram_image(number)
+
+		if last_number < 64:
+			# Idle callbacks added here run on the next idle pass, after pending events
+			self.root.after_idle(self.preload_hexagram_images, last_number + 1)
+		elif constants.HEXAGRAM_IMAGE_ATLAS:
+			self.save_hexagram_atlas()
+
+	def hexagram_image_path(self, number):
+		return os.path.join(constants.IMAGES_DIR, f'hexagram{number:02d}.gif')
+
+	def atlas_cell(self, number, width, height):
+		"""Returns the (x, y) of a hexagram in the 8x8 atlas grid"""
+		index = number - 1
+		return (index % 8) * width, (index // 8) * height
+
+	def load_hexagram_atlas(self):
+		"""
+		Load all display-size images from the sprite atlas in one decode
+		Returns:
+			False if the atlas is missing or older than any of the GIFs
+		"""
+		atlas_path = os.path.join(constants.CACHE_DIR, 'hexagram_atlas.png')
+		try:
+			atlas_time = os.path.getmtime(atlas_path)
+			gif_paths = [self.hexagram_image_path(number) for number in range(1, 65)]
+			if any(os.path.getmtime(path) > atlas_time for path in gif_paths if os.path.exists(path)):
+				return False
+			atlas = tk.PhotoImage(file=atlas_path)
+		except (OSError, tk.TclError):
+			return False
+
+		width = atlas.width() // 8
+		height = atlas.height() // 8
+		for number in range(1, 65):
+			if not os.path.exists(self.hexagram_image_path(number)):
+				continue
+			x, y = self.atlas_cell(number, width, height)
+			image = tk.PhotoImage(width=width, height=height)
+			image.tk.call(image, 'copy', atlas, '-from', x, y, x + width, y + height)
+			self.hexagram_images[number] = image
+		return True
+
+	def save_hexagram_atlas(self):
+		"""Write every loaded image into one 8x8 sprite atlas for the next start"""
+		if not self.hexagram_images:
+			return
+		width = max(image.width() for image in self.hexagram_images.values())
+		height = max(image.height() for image in self.hexagram_images.values())
+		atlas = tk.PhotoImage(width=width * 8, height=height * 8)
+		for number, image in self.hexagram_images.items():
+			x, y = self.atlas_cell(number, width, height)
+			atlas.tk.call(atlas, 'copy', image, '-to', x, y)
+		try:
+			os.makedirs(constants.CACHE_DIR, exist_ok=True)
+			atlas.write(os.path.join(constants.CACHE_DIR, 'hexagram_atlas.png'), format='png')
+		except (OSError, tk.TclError) as e:
+			print(f"Failed to save hexagram atlas: {e}")
+
+	def show_hexagram_image(self, label, number):
+		"""Point a label at a hexagram image, only touching the widget when the number changes"""
+		if getattr(label, 'hexagram_number', None) == number:
+			self.image_update_counts['skipped'] += 1
+			return
+		image = self.load_hexagram_image(number)
+		if image:
+			label.configure(image=image)
+			label.image = image  # Keep a reference
+			label.hexagram_number = number
+			self.image_update_counts['configured'] += 1
+
+	def clear_hexagram_image(self, label):
+		"""Remove the image from a label"""
+		if getattr(label, 'hexagram_number', None) is None and not getattr(label, 'image', None):
+			self.image_update_counts['skipped'] += 1
+			return
+		label.configure(image='')
+		label.image = None
+		label.hexagram_number = None
+		self.image_update_counts['configured'] += 1
+
 	def load_hexagram_image(self, number):
 		"""Load a hexagram image by its number (1-64)"""
 		if number not in self.hexagram_images:
-			image_path = os.path.join(constants.IMAGES_DIR, f'hexagram{number:02d}.gif')
+			image_path = self.hexagram_image_path(number)
 			if os.path.exists(image_path):
 				try:
 					photo = tk.PhotoImage(file=image_path)
@@ -267,172 +414,101 @@ class GUIManager:
 		self.check_text.configure(state='disabled')
 
 
-	def update_display(self, hexagrams, time_to_zero, text_widget=None, input_datetime=None):
+	def submit_snapshot(self, hexagrams, time_to_zero):
+		"""Queue a snapshot for the main display. Safe to call from any thread, never blocks"""
+		item = (time.perf_counter(), hexagrams, time_to_zero)
+		while True:
+			try:
+				self.snapshot_queue.put_nowait(item)
+				return
+			except queue.Full:
+				# Make room by dropping the oldest frame
+				try:
+					self.snapshot_queue.get_nowait()
+					self.frame_stats.drop()
+				except queue.Empty:
+					pass
+
+	def drain_snapshots(self):
+		"""Show the newest queued snapshot, runs on the Tk thread"""
+		latest = None
+		while True:
+			try:
+				item = self.snapshot_queue.get_nowait()
+			except queue.Empty:
+				break
+			if latest is not None:
+				self.frame_stats.drop()
+			latest = item
+
+		try:
+			if latest is not None:
+				submitted_at, hexagrams, time_to_zero = latest
+				render_started_at = time.perf_counter()
+				self.update_display(hexagrams, time_to_zero)
+				self.frame_stats.record(submitted_at, render_started_at, time.perf_counter())
+		finally:
+			# Keep draining even if a frame failed, or the panel would freeze
+			self.drain_job = self.root.after(constants.GUI_DRAIN_INTERVAL_MS, self.drain_snapshots)
+
+	def update_display(self, hexagrams, time_to_zero, text_widget=None):
 		"""Update the GUI display with hexagram information"""
 		if text_widget is None:
 			text_widget = self.output_text
 			# Update hexagram images only for main display
-			for hexagram in hexagrams:
-				level, _, _, hexagram_number, _, _ = hexagram
-				image = self.load_hexagram_image(hexagram_number)
-				if image and level in self.hexagram_labels:
-					self.hexagram_labels[level].configure(image=image)
-					self.hexagram_labels[level].image = image  # Keep a reference
+			for reading in hexagrams:
+				if reading.level in self.hexagram_labels:
+					self.show_hexagram_image(self.hexagram_labels[reading.level], reading.hexagram_number)
 		
-		message_lines = []
 		if not hexagrams:
-			message_lines.append("No hexagrams found for the current date.")
+			message_lines = ["No hexagrams found for the current date."]
 		else:
-			if input_datetime:
-				current_date = input_datetime.date()
-				current_time = input_datetime.time()
-			else:
-				current_date = datetime.datetime.now().date()
-				current_time = datetime.datetime.now().time()
-			
-			days_to_zero = round(time_to_zero.total_seconds() / 86400, 4)
-			message_lines.append(f"Hexagrams for: {current_date} - {current_time}")
-			message_lines.append(f"Days to 0: {days_to_zero}")
-			message_lines.append(f"Zero Date: {constants.ZERO_DATETIME}")
-			
-			for level, cycle_length, _cycle_name, hexagram_number, hexagram_name, time_since_last_change in hexagrams:
-				hexagram_first_name = hexagram_name.split(" - ")[0]
-				moving_line = int((time_since_last_change // (cycle_length.total_seconds() / 6)) + 1)
-
-				if level == 1:
-					milliseconds = int(abs(time_since_last_change * 1000))
-					cycle_length_str = f"{cycle_length.total_seconds():.4f}"
-					message_lines.append(f"Level {level}: {cycle_length_str} s, Hexagram {hexagram_number} - {hexagram_name}")
-					message_lines.append(f"Level 1 changes in: {milliseconds:03d}ms")
-					message_lines.append(f"Level {level}: Moving Line: {moving_line}")
-					
-					# Only play sounds for main display
-					if text_widget == self.output_text:
-						if constants.previous_hexagrams[f'level_{level}'] != hexagram_number:
-							constants.previous_hexagrams[f'level_{level}'] = hexagram_number
-							if constants.PLAY_AUDIO_LEVEL_1_ENABLED:
-								self.sound_manager.play_level_sound(1)
-
-						if constants.previous_hexagrams[f'level_{level}_line'] != moving_line:
-							constants.previous_hexagrams[f'level_{level}_line'] = moving_line
-							if constants.PLAY_AUDIO_LEVEL_1_LINE_ENABLED:
-								self.sound_manager.play_line_sound(1)
-
-				elif level == 2:
-					minutes = int(abs(time_since_last_change // 60))
-					seconds = int(abs(time_since_last_change % 60))
-					message_lines.append(f"Level {level}: {cycle_length.total_seconds()} s, Hexagram {hexagram_number} - {hexagram_name}")
-					message_lines.append(f"Level 2 changes in: {minutes:02d}:{seconds:02d}")
-					message_lines.append(f"Level {level}: Moving Line: {moving_line}")
-					
-					if text_widget == self.output_text:
-						if constants.previous_hexagrams[f'level_{level}'] != hexagram_number:
-							constants.previous_hexagrams[f'level_{level}'] = hexagram_number
-							if constants.PLAY_AUDIO_LEVEL_2_ENABLED:
-								self.sound_manager.play_level_sound(2)
-
-						if constants.previous_hexagrams[f'level_{level}_line'] != moving_line:
-							constants.previous_hexagrams[f'level_{level}_line'] = moving_line
-							if constants.PLAY_AUDIO_LEVEL_2_LINE_ENABLED:
-								self.sound_manager.play_line_sound(2)
-
-				elif level == 3:
-					hours = int(abs(time_since_last_change // 3600))
-					minutes = int(abs((time_since_last_change % 3600) // 60))
-					seconds = int(abs(time_since_last_change % 60))
-					cycle_length_str = f"{cycle_length.total_seconds() / 3600:.2f}"
-					message_lines.append(f"Level {level}: {cycle_length_str} h, Hexagram {hexagram_number} - {hexagram_name}")
-					message_lines.append(f"Level 3 changes in: {hours:02d}:{minutes:02d}:{seconds:02d}")
-					message_lines.append(f"Level {level}: Moving Line: {moving_line}")
-					
-					if text_widget == self.output_text:
-						if constants.previous_hexagrams[f'level_{level}'] != hexagram_number:
-							constants.previous_hexagrams[f'level_{level}'] = hexagram_number
-							if constants.PLAY_AUDIO_LEVEL_3_ENABLED:
-								self.sound_manager.play_level_sound(3)
-
-						if constants.previous_hexagrams[f'level_{level}_line'] != moving_line:
-							constants.previous_hexagrams[f'level_{level}_line'] = moving_line
-							if constants.PLAY_AUDIO_LEVEL_3_LINE_ENABLED:
-								self.sound_manager.play_line_sound(3)
-
-				elif level == 4:
-					seconds = int(abs(time_since_last_change % 60))
-					minutes = int(abs((time_since_last_change % 3600) // 60))
-					hours = int(abs(time_since_last_change // 3600))
-					days = hours // 24
-					hours = hours % 24
-					cycle_length_str = f"{cycle_length.total_seconds() / 86400:.2f}"
-					message_lines.append(f"Level {level}: {cycle_length_str} days, Hexagram {hexagram_number} - {hexagram_name}")
-					message_lines.append(f"Level 4 changes in: {days:02d}:{hours:02d}:{minutes:02d}:{seconds:02d}")
-					message_lines.append(f"Level {level}: Moving Line: {moving_line}")
-					
-					if text_widget == self.output_text:
-						if constants.previous_hexagrams[f'level_{level}'] != hexagram_number:
-							constants.previous_hexagrams[f'level_{level}'] = hexagram_number
-							if constants.PLAY_AUDIO_LEVEL_4_ENABLED:
-								self.sound_manager.play_level_sound(4)
-
-						if constants.previous_hexagrams[f'level_{level}_line'] != moving_line:
-							constants.previous_hexagrams[f'level_{level}_line'] = moving_line
-							if constants.PLAY_AUDIO_LEVEL_4_LINE_ENABLED:
-								self.sound_manager.play_line_sound(4)
-
-				elif level == 5:
-					seconds = int(abs(time_since_last_change % 60))
-					minutes = int(abs((time_since_last_change % 3600) // 60))
-					hours = int(abs(time_since_last_change // 3600))
-					days = hours // 24
-					remaining_days = days
-					hours = hours % 24
-					cycle_length_str = f"{cycle_length.total_seconds() / 86400:.2f}"
-					message_lines.append(f"Level {level}: {cycle_length_str} days, Hexagram {hexagram_number} - {hexagram_name}")
-					message_lines.append(f"Level 5 changes in: {remaining_days:03d}d{hours:02d}:{minutes:02d}:{seconds:02d}")
-					message_lines.append(f"Level {level}: Moving Line: {moving_line}")
-					
-					if text_widget == self.output_text:
-						if constants.previous_hexagrams[f'level_{level}'] != hexagram_number:
-							constants.previous_hexagrams[f'level_{level}'] = hexagram_number
-							if constants.PLAY_AUDIO_LEVEL_5_ENABLED:
-								self.sound_manager.play_level_sound(5)
-
-						if constants.previous_hexagrams[f'level_{level}_line'] != moving_line:
-							constants.previous_hexagrams[f'level_{level}_line'] = moving_line
-							if constants.PLAY_AUDIO_LEVEL_5_LINE_ENABLED:
-								self.sound_manager.play_line_sound(5)
-
-				elif level == 6:
-					seconds = int(abs(time_since_last_change % 60))
-					minutes = int(abs((time_since_last_change % 3600) // 60))
-					hours = int(abs(time_since_last_change // 3600))
-					days = hours // 24
-					remaining_days = days
-					hours = hours % 24
-					cycle_length_str = f"{cycle_length.total_seconds() / 86400:.2f}"
-					message_lines.append(f"Level {level}: {cycle_length_str} days, Hexagram {hexagram_number} - {hexagram_name}")
-					message_lines.append(f"Level 6 changes in: {remaining_days:03d}d{hours:02d}:{minutes:02d}:{seconds:02d}")
-					message_lines.append(f"Level {level}: Moving Line: {moving_line}")
-					
-					if text_widget == self.output_text:
-						if constants.previous_hexagrams.get(f'level_{level}') != hexagram_number:
-							constants.previous_hexagrams[f'level_{level}'] = hexagram_number
-							if constants.PLAY_AUDIO_LEVEL_6_ENABLED:
-								self.sound_manager.play_level_sound(6)
-
-						if constants.previous_hexagrams.get(f'level_{level}_line') != moving_line:
-							constants.previous_hexagrams[f'level_{level}_line'] = moving_line
-							if constants.PLAY_AUDIO_LEVEL_6_LINE_ENABLED:
-								self.sound_manager.play_line_sound(6)
-
+			message_lines = message_formatter.get_layout('gui', self.hexagram_calculator.cycles).render_lines(hexagrams, time_to_zero)
 
 		# Update the text box with the hexagram output
+		if text_widget == self.output_text and constants.GUI_DIFF_RENDERING:
+			self.render_changed_text(text_widget, message_lines)
+			return
+
 		text_widget.configure(state='normal')
 		text_widget.delete("1.0", tk.END)
 		for line in message_lines:
 			text_widget.insert(tk.END, line + "\n")
 		text_widget.configure(state='disabled')
 		text_widget.see(tk.END)
-		text_widget.update_idletasks()
+		self.rendered_lines.pop(text_widget, None)
+
+	def render_changed_text(self, text_widget, lines):
+		"""Write lines into a text widget, rewriting only the characters that changed since the last call"""
+		previous = self.rendered_lines.get(text_widget)
+		if previous is not None and len(previous) == len(lines):
+			edits = []
+			for number, (old_line, new_line) in enumerate(zip(previous, lines), start=1):
+				if old_line == new_line:
+					continue
+				# Keep the unchanged start and end of the line, e.g. everything
+				# around the digits of a countdown
+				start = len(os.path.commonprefix([old_line, new_line]))
+				end = 0
+				max_end = min(len(old_line), len(new_line)) - start
+				while end < max_end and old_line[-1 - end] == new_line[-1 - end]:
+					end += 1
+				edits.append((number, start, len(old_line) - end, new_line[start:len(new_line) - end]))
+			if not edits:
+				return
+
+			text_widget.configure(state='normal')
+			for number, start, old_end, text in edits:
+				text_widget.delete(f"{number}.{start}", f"{number}.{old_end}")
+				text_widget.insert(f"{number}.{start}", text)
+		else:
+			# The layout changed, so draw everything once
+			text_widget.configure(state='normal')
+			text_widget.delete("1.0", tk.END)
+			text_widget.insert(tk.END, "".join(line + "\n" for line in lines))
+			text_widget.see(tk.END)
+		text_widget.configure(state='disabled')
+		self.rendered_lines[text_widget] = list(lines)
 
 	def toggle_send_to_vrchat(self):
 		constants.SEND_TO_VRCHAT_ENABLED = not constants.SEND_TO_VRCHAT_ENABLED
@@ -463,13 +539,8 @@ class GUIManager:
 			time_to_zero = constants.ZERO_DATETIME - current_datetime
 			hexagrams = self.hexagram_calculator.get_hexagrams(time_to_zero)
 			
-			# Update previous hexagrams state before display update
-			for level in range(1, 7):
-				for hexagram in hexagrams:
-					if hexagram[0] == level:
-						constants.previous_hexagrams[f'level_{level}'] = hexagram[3]
-						moving_line = int((hexagram[5] // (hexagram[1].total_seconds() / 6)) + 1)
-						constants.previous_hexagrams[f'level_{level}_line'] = moving_line
+			# Queued sounds were timed for the old zero date
+			self.sound_manager.cancel_cues()
 			
 			# Update display without audio
 			self.audio_playback_allowed = False
@@ -493,18 +564,15 @@ class GUIManager:
 			hexagrams = self.hexagram_calculator.get_hexagrams(time_to_zero)
 			
 			# Update hexagram images in check section
-			for hexagram in hexagrams:
-				level, _, _, hexagram_number, _, _ = hexagram
-				image = self.load_hexagram_image(hexagram_number)
-				if image and level in self.check_hexagram_labels:
-					self.check_hexagram_labels[level].configure(image=image)
-					self.check_hexagram_labels[level].image = image  # Keep a reference
+			for reading in hexagrams:
+				if reading.level in self.check_hexagram_labels:
+					self.show_hexagram_image(self.check_hexagram_labels[reading.level], reading.hexagram_number)
 			
 			# Display the hexagrams in the check text widget
 			self.check_text.configure(state='normal')
 			self.check_text.delete("1.0", tk.END)
 			self.check_text.insert(tk.END, f"Results for {date_str} {time_str}\n\n")
-			self.update_display(hexagrams, time_to_zero, self.check_text, input_datetime)
+			self.update_display(hexagrams, time_to_zero, self.check_text)
 			self.check_text.configure(state='disabled')
 		except ValueError:
 			# Show error in the check text widget
@@ -515,7 +583,7 @@ class GUIManager:
 			# Clear hexagram images
 			for level in range(1, 7):
 				if level in self.check_hexagram_labels:
-					self.check_hexagram_labels[level].configure(image='')
+					self.clear_hexagram_image(self.check_hexagram_labels[level])
 
 	def update_text_widget(self, widget, hexagrams, time_to_zero, current_time=None):
 		if not current_time:
@@ -531,9 +599,7 @@ class GUIManager:
 
 	def format_hexagram_message(self, hexagrams, time_to_zero, current_time):
 		# Format the message based on the current page
-		if self.current_page == 1:
-			return self.vrchat_manager.format_message_page1(hexagrams, time_to_zero)
-		return self.vrchat_manager.format_message_page2(hexagrams, time_to_zero)
+		return self.vrchat_manager.format_page(self.current_page, hexagrams, time_to_zero)
 
 	def enable_audio_playback(self):
 		self.audio_playback_allowed = True
@@ -686,6 +752,8 @@ class GUIManager:
 		setattr(constants, attr_name, not current_state)
 		button = getattr(self, f'level_{level}_button')
 		button.config(text=f"Play Audio Level {level}: {'ON' if not current_state else 'OFF'}")
+		# Load the sound in the background, or free it once turned off
+		self.sound_manager.sync_sounds()
 
 	def toggle_line_sound(self, level):
 		"""Toggle the moving line sound for a specific level"""
@@ -694,11 +762,14 @@ class GUIManager:
 		setattr(constants, attr_name, not current_state)
 		button = getattr(self, f'level_{level}_line_button')
 		button.config(text=f"Level {level} Moving Line Audio: {'ON' if not current_state else 'OFF'}")
+		# Load the sound in the background, or free it once turned off
+		self.sound_manager.sync_sounds()
 
 	def run(self):
 		self.root.mainloop()
 
 	def cleanup(self):
+		self.root.after_cancel(self.drain_job)
 		if self.calculator_window:
 			self.calculator_window.destroy()
 		if self.sound_menu_window:
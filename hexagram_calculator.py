@@ -1,6 +1,60 @@
+import collections
 import datetime
+import heapq
+import constants
 from constants import HEXAGRAM_NAMES
 
+def load_numpy():
+	"""Imports NumPy on first use so that it stays out of startup, returns None if it is missing"""
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+# Time is counted in integer ticks of 1/2048 s. Every cycle length and every
+# moving line boundary (a sixth of a cycle) is a whole number of ticks, so all
+# level arithmetic below is exact integer divmod.
+TICKS_PER_SECOND = 2048
+LEVEL_1_CYCLE_TICKS = 4050  # 1.9775390625 s
+CYCLE_TICKS = [LEVEL_1_CYCLE_TICKS * 64 ** level for level in range(6)]
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+HEXAGRAM_FIRST_NAMES = [name.split(" - ")[0] for name in HEXAGRAM_NAMES]
+
+class HexagramReading(collections.namedtuple('HexagramReading', [
+	'level',
+	'cycle_length',
+	'cycle_name',
+	'hexagram_number',
+	'hexagram_name',
+	'first_name',
+	'moving_line',
+	'time_since_last_change',
+	'time_to_next_change'
+])):
+	"""Immutable reading of one level at one moment"""
+	__slots__ = ()
+
+class HexagramSnapshot:
+	"""The readings of all six levels at one moment, indexed by level (1-6)"""
+	__slots__ = ('time_to_zero', 'readings')
+
+	def __init__(self, time_to_zero, readings):
+		self.time_to_zero = time_to_zero
+		self.readings = tuple(readings)
+
+	def __getitem__(self, level):
+		if not 1 <= level <= len(self.readings):
+			raise IndexError(f"Invalid level: {level}")
+		return self.readings[level - 1]
+
+	def __iter__(self):
+		return iter(self.readings)
+
+	def __len__(self):
+		return len(self.readings)
+
 class HexagramCalculator:
 	def __init__(self):
 		self.cycles = [
@@ -11,32 +65,326 @@ class HexagramCalculator:
 			datetime.timedelta(days=384),
 			datetime.timedelta(days=24576)  # 384 days * 64
 		]
+		self.cycle_seconds = [cycle.total_seconds() for cycle in self.cycles]
+		self.cycle_ticks = dict(zip(self.cycles, CYCLE_TICKS))
+
+	def to_ticks(self, time_to_zero):
+		"""Converts a time_to_zero timedelta into whole ticks away from the zero date"""
+		microseconds = abs(time_to_zero) // ONE_MICROSECOND
+		return microseconds * TICKS_PER_SECOND // 1000000
+
+	def get_levels(self, ticks):
+		"""Returns (hexagram_number, moving_line, ticks_since_last_change) for all six levels"""
+		levels = []
+		for cycle_ticks in CYCLE_TICKS:
+			cycle_number, phase = divmod(ticks, cycle_ticks)
+			levels.append((cycle_number % 64 + 1, phase * 6 // cycle_ticks + 1, phase))
+		return levels
 
 	def get_hexagrams(self, time_to_zero):
-		hexagrams = []
-		total_seconds = abs(time_to_zero.total_seconds())
-
-		for level in range(6):  # Changed from 5 to 6
-			cycle_length = self.cycles[level]
-			if level == 0:
-				level_2_cycle_length = self.cycles[1]
-				cycle_number_level_2 = int(total_seconds // level_2_cycle_length.total_seconds())
-				cycle_number = (cycle_number_level_2 * 64 + int((total_seconds % level_2_cycle_length.total_seconds()) // cycle_length.total_seconds())) % 64
+		"""Returns a HexagramSnapshot of all six levels for a time_to_zero timedelta"""
+		microseconds = time_to_zero // ONE_MICROSECOND
+		counting_down = microseconds > 0
+		ticks = abs(microseconds) * TICKS_PER_SECOND // 1000000
+
+		# Build the readings with tuple.__new__ directly, this runs on every frame
+		new_reading = tuple.__new__
+		readings = []
+		for level, cycle_ticks in enumerate(CYCLE_TICKS):
+			cycle_number, phase = divmod(ticks, cycle_ticks)
+			hexagram_index = cycle_number % 64
+			time_since_last_change = phase / TICKS_PER_SECOND
+			# The tick count into the cycle runs down to the next change before
+			# the zero date and up after it
+			if counting_down:
+				time_to_next_change = time_since_last_change
 			else:
-				cycle_number = int(total_seconds // cycle_length.total_seconds()) % 64
-			
-			time_since_last_change = total_seconds % cycle_length.total_seconds()
-			hexagram_number = (cycle_number % 64) + 1
-			hexagrams.append((
+				time_to_next_change = (cycle_ticks - phase) / TICKS_PER_SECOND
+			readings.append(new_reading(HexagramReading, (
 				level + 1,
-				cycle_length,
+				self.cycles[level],
 				"h",
-				hexagram_number,
-				HEXAGRAM_NAMES[hexagram_number - 1],
-				time_since_last_change
+				hexagram_index + 1,
+				HEXAGRAM_NAMES[hexagram_index],
+				HEXAGRAM_FIRST_NAMES[hexagram_index],
+				phase * 6 // cycle_ticks + 1,
+				time_since_last_change,
+				time_to_next_change
+			)))
+
+		return HexagramSnapshot(time_to_zero, readings)
+
+	def get_next_transitions(self, time_to_zero, current_datetime):
+		"""
+		Returns the wall-clock times of the next hexagram and moving line change for each level
+		Args:
+			time_to_zero: Zero datetime minus current_datetime
+			current_datetime: The datetime time_to_zero was measured at
+		Returns:
+			List of (level, next_hexagram_change, next_line_change) tuples. Each
+			datetime is the first microsecond at which the new value is showing.
+		"""
+		microseconds = time_to_zero // ONE_MICROSECOND
+		# Before the zero date the tick count shrinks, so the next change is the
+		# boundary below the current tick; after it the count grows again
+		counting_down = microseconds > 0
+		microseconds = abs(microseconds)
+		ticks = microseconds * TICKS_PER_SECOND // 1000000
+
+		transitions = []
+		for level, cycle_ticks in enumerate(CYCLE_TICKS):
+			transitions.append((
+				level + 1,
+				current_datetime + self._delay_to_next_boundary(microseconds, ticks, cycle_ticks, counting_down),
+				current_datetime + self._delay_to_next_boundary(microseconds, ticks, cycle_ticks // 6, counting_down)
 			))
 
-		return hexagrams
+		return transitions
+
+	def _delay_to_next_boundary(self, microseconds, ticks, period_ticks, counting_down):
+		"""Whole microseconds until the tick count crosses the next multiple of period_ticks"""
+		boundary = ticks - ticks % period_ticks
+		if not counting_down:
+			return self._delay_to_boundary(microseconds, boundary + period_ticks, False)
+		if boundary > 0:
+			return self._delay_to_boundary(microseconds, boundary, True)
+		# Nothing changes while the count passes through zero, so the next
+		# change is one period after the zero date
+		return datetime.timedelta(microseconds=microseconds) + self._delay_to_boundary(0, period_ticks, False)
+
+	def _delay_to_boundary(self, microseconds, boundary_ticks, counting_down):
+		"""Whole microseconds until the tick count crosses boundary_ticks"""
+		# Compare in 1/32 microsecond units, where a tick is exactly 15625 units
+		position = microseconds * 32
+		boundary = boundary_ticks * 15625
+		if counting_down:
+			delay = (position - boundary) // 32 + 1
+		else:
+			delay = -((position - boundary) // 32)
+		return datetime.timedelta(microseconds=delay)
+
+	def iter_transitions(self, start, end, levels=range(1, 7), zero_datetime=None, lines=True):
+		"""
+		Lazily yields every change between two datetimes in time order
+		Args:
+			start: Datetime to start from, changes at or before it are skipped
+			end: Datetime to stop at, changes at or after it are not yielded
+			levels: Levels to include
+			zero_datetime: Zero datetime to use, defaults to constants.ZERO_DATETIME
+			lines: If False only hexagram changes are yielded, not moving line changes
+		Yields:
+			(timestamp, level, old_hexagram, new_hexagram, old_line, new_line)
+			tuples. The timestamp is the first microsecond showing the new values.
+		"""
+		if zero_datetime is None:
+			zero_datetime = constants.ZERO_DATETIME
+		streams = [self._iter_level_transitions(start, end, level, zero_datetime, lines) for level in levels]
+		if len(streams) == 1:
+			return streams[0]
+		return heapq.merge(*streams)
+
+	def _iter_level_transitions(self, start, end, level, zero_datetime, lines):
+		"""Yields the transitions of a single level, see iter_transitions"""
+		cycle_ticks = CYCLE_TICKS[level - 1]
+		period_ticks = cycle_ticks // 6 if lines else cycle_ticks
+		microseconds = (zero_datetime - start) // ONE_MICROSECOND
+
+		if microseconds > 0:
+			# Before the zero date: walk boundaries down towards zero, the
+			# value changes once the time to zero drops below each one
+			ticks = microseconds * TICKS_PER_SECOND // 1000000
+			boundary = ticks - ticks % period_ticks
+			while boundary > 0:
+				timestamp = zero_datetime - datetime.timedelta(microseconds=(boundary * 15625 - 1) // 32)
+				if timestamp >= end:
+					return
+				yield (timestamp, level) + self._transition_values(boundary, boundary - 1, cycle_ticks)
+				boundary -= period_ticks
+			# Nothing changes while passing through zero
+			boundary = period_ticks
+		else:
+			ticks = -microseconds * TICKS_PER_SECOND // 1000000
+			boundary = ticks - ticks % period_ticks + period_ticks
+
+		while True:
+			timestamp = zero_datetime + datetime.timedelta(microseconds=-(-boundary * 15625 // 32))
+			if timestamp >= end:
+				return
+			yield (timestamp, level) + self._transition_values(boundary - 1, boundary, cycle_ticks)
+			boundary += period_ticks
+
+	def _transition_values(self, old_ticks, new_ticks, cycle_ticks):
+		"""Returns (old_hexagram, new_hexagram, old_line, new_line) across a boundary"""
+		old_cycle, old_phase = divmod(old_ticks, cycle_ticks)
+		new_cycle, new_phase = divmod(new_ticks, cycle_ticks)
+		return (
+			old_cycle % 64 + 1,
+			new_cycle % 64 + 1,
+			old_phase * 6 // cycle_ticks + 1,
+			new_phase * 6 // cycle_ticks + 1
+		)
+
+	def find_times(self, constraints, start, end, zero_datetime=None, limit=None):
+		"""
+		Finds every interval in a window where the given levels show the given values
+		Args:
+			constraints: Dict of level -> (hexagram_number, moving_line). Either
+				value may be None to match anything, e.g. {3: (29, 4), 4: (12, None)}
+			start: Start of the window
+			end: End of the window (exclusive)
+			zero_datetime: Zero datetime to use, defaults to constants.ZERO_DATETIME
+			limit: Stop after this many intervals
+		Returns:
+			List of (interval_start, interval_end) datetimes in time order. Ends
+			are exclusive, and intervals are clipped to the window.
+		"""
+		if zero_datetime is None:
+			zero_datetime = constants.ZERO_DATETIME
+
+		# Each constraint holds on one window per period of ticks. Periods are
+		# powers of 64 times the level 1 cycle, so they all divide each other
+		windows = []
+		for level, (hexagram_number, moving_line) in constraints.items():
+			if level not in range(1, 7):
+				raise ValueError(f"Invalid level: {level}")
+			cycle_ticks = CYCLE_TICKS[level - 1]
+			period = cycle_ticks
+			window_start = 0
+			window_end = cycle_ticks
+			if hexagram_number is not None:
+				if hexagram_number not in range(1, 65):
+					raise ValueError(f"Invalid hexagram number: {hexagram_number}")
+				period = cycle_ticks * 64
+				window_start = (hexagram_number - 1) * cycle_ticks
+				window_end = window_start + cycle_ticks
+			if moving_line is not None:
+				if moving_line not in range(1, 7):
+					raise ValueError(f"Invalid moving line: {moving_line}")
+				window_end = window_start + moving_line * cycle_ticks // 6
+				window_start += (moving_line - 1) * cycle_ticks // 6
+			windows.append((period, window_start, window_end))
+		windows.sort(reverse=True)
+
+		intervals = []
+		for interval in self._iter_matching_intervals(windows, start, end, zero_datetime):
+			if intervals and intervals[-1][1] == interval[0]:
+				intervals[-1] = (intervals[-1][0], interval[1])
+				continue
+			if limit is not None and len(intervals) >= limit:
+				break
+			intervals.append(interval)
+		return intervals
+
+	def _iter_matching_intervals(self, windows, start, end, zero_datetime):
+		"""Yields matching (start, end) datetimes in time order, possibly touching"""
+		start_microseconds = (zero_datetime - start) // ONE_MICROSECOND
+		end_microseconds = (zero_datetime - end) // ONE_MICROSECOND
+
+		if start_microseconds >= 0:
+			# Up to the zero date the tick count runs down towards zero
+			low_ticks = max(end_microseconds + 1, 0) * TICKS_PER_SECOND // 1000000
+			high_ticks = start_microseconds * TICKS_PER_SECOND // 1000000 + 1
+			for low, high in self._iter_matching_ticks(windows, low_ticks, high_ticks, True):
+				interval_start = zero_datetime - datetime.timedelta(microseconds=(high * 15625 - 1) // 32)
+				interval_end = zero_datetime - datetime.timedelta(microseconds=(low * 15625 - 1) // 32)
+				interval_start = max(interval_start, start)
+				interval_end = min(interval_end, end)
+				if interval_start < interval_end:
+					yield (interval_start, interval_end)
+			# The zero date itself was covered above
+			start = zero_datetime + ONE_MICROSECOND
+			start_microseconds = -1
+
+		if end_microseconds < -1:
+			low_ticks = -start_microseconds * TICKS_PER_SECOND // 1000000
+			high_ticks = -(end_microseconds + 1) * TICKS_PER_SECOND // 1000000 + 1
+			for low, high in self._iter_matching_ticks(windows, low_ticks, high_ticks, False):
+				interval_start = zero_datetime + datetime.timedelta(microseconds=-(-low * 15625 // 32))
+				interval_end = zero_datetime + datetime.timedelta(microseconds=-(-high * 15625 // 32))
+				interval_start = max(interval_start, start)
+				interval_end = min(interval_end, end)
+				if interval_start < interval_end:
+					yield (interval_start, interval_end)
+
+	def _iter_matching_ticks(self, windows, low, high, descending):
+		"""Yields the [low, high) tick ranges that fall inside every window"""
+		if not windows:
+			yield (low, high)
+			return
+
+		period, window_start, window_end = windows[0]
+		first = low // period
+		last = (high - 1) // period
+		cycles = range(last, first - 1, -1) if descending else range(first, last + 1)
+		for cycle in cycles:
+			range_low = max(low, cycle * period + window_start)
+			range_high = min(high, cycle * period + window_end)
+			if range_low < range_high:
+				yield from self._iter_matching_ticks(windows[1:], range_low, range_high, descending)
+
+	def get_hexagrams_batch(self, times, zero_datetime=None):
+		"""
+		Calculates all six levels for many times in one pass
+		Args:
+			times: Sequence or NumPy array of seconds. Offsets from zero (the same
+				value as time_to_zero.total_seconds()) unless zero_datetime is given,
+				in which case they are epoch seconds.
+			zero_datetime: Optional zero datetime used to convert epoch seconds
+		Returns:
+			Dict of columns. 'level' holds the six level numbers, the other
+			columns have one row per time and one column per level.
+		"""
+		np = load_numpy()
+		if np is None:
+			return self._get_hexagrams_batch_python(times, zero_datetime)
+
+		total_seconds = np.asarray(times, dtype=np.float64)
+		if zero_datetime is not None:
+			total_seconds = zero_datetime.timestamp() - total_seconds
+		total_seconds = np.abs(total_seconds).reshape(-1, 1)
+
+		# Round to whole microseconds the same way timedelta(seconds=...) does
+		whole_seconds = np.floor(total_seconds)
+		microseconds = (whole_seconds.astype(np.int64) * 1000000
+			+ np.round((total_seconds - whole_seconds) * 1000000).astype(np.int64))
+		ticks = microseconds * 32 // 15625  # * TICKS_PER_SECOND // 1000000
+
+		cycle_ticks = np.array(CYCLE_TICKS, dtype=np.int64)
+		cycle_numbers, phases = np.divmod(ticks, cycle_ticks)
+
+		return {
+			'level': np.arange(1, 7),
+			'hexagram_number': cycle_numbers % 64 + 1,
+			'moving_line': phases * 6 // cycle_ticks + 1,
+			'time_since_last_change': phases / TICKS_PER_SECOND
+		}
+
+	def _get_hexagrams_batch_python(self, times, zero_datetime=None):
+		"""Pure Python version of get_hexagrams_batch for machines without NumPy"""
+		zero_timestamp = zero_datetime.timestamp() if zero_datetime is not None else None
+		hexagram_numbers = []
+		moving_lines = []
+		times_since_last_change = []
+
+		for time_value in times:
+			total_seconds = float(time_value)
+			if zero_timestamp is not None:
+				total_seconds = zero_timestamp - total_seconds
+			levels = self.get_levels(self.to_ticks(datetime.timedelta(seconds=total_seconds)))
+
+			hexagram_numbers.append([hexagram_number for hexagram_number, _, _ in levels])
+			moving_lines.append([moving_line for _, moving_line, _ in levels])
+			times_since_last_change.append([phase / TICKS_PER_SECOND for _, _, phase in levels])
+
+		return {
+			'level': list(range(1, 7)),
+			'hexagram_number': hexagram_numbers,
+			'moving_line': moving_lines,
+			'time_since_last_change': times_since_last_change
+		}
 
 	def calculate_moving_line(self, time_since_last_change, cycle_length):
-		return int((time_since_last_change // (cycle_length.total_seconds() / 6)) + 1)
\ No newline at end of file
+		cycle_ticks = self.cycle_ticks.get(cycle_length)
+		if cycle_ticks is None:
+			cycle_ticks = round(cycle_length.total_seconds() * TICKS_PER_SECOND)
+		return int(time_since_last_change * TICKS_PER_SECOND) * 6 // cycle_ticks + 1
\ No newline at end of file
@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+class SwarmClient:
+	"""Subscriber that counts the messages it receives"""
+	def __init__(self, kind, slow=False):
+		self.kind = kind
+		self.slow = slow
+		self.messages = 0
+		self.buffer = b''
+
+	async def run(self, host, port, duration):
+		if self.slow:
+			# A tiny receive buffer makes the server see this client fall behind quickly
+			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+			sock.setblocking(False)
+			await asyncio.get_running_loop().sock_connect(sock, (host, port))
+			reader, writer = await asyncio.open_connection(sock=sock)
+		else:
+			reader, writer = await asyncio.open_connection(host, port)
+		if self.kind == 'sse':
+			writer.write(f"GET /events HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+		else:
+			key = base64.b64encode(os.urandom(16)).decode()
+			query = '?format=binary' if self.kind == 'binary' else ''
+			writer.write((
+				f"GET /ws{query} HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\n"
+				f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+			).encode())
+		await reader.readuntil(b'\r\n\r\n')
+
+		deadline = time.monotonic() + duration
+		try:
+			while True:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				if self.slow:
+					# Stop reading so the server has to drop this client's frames
+					await asyncio.sleep(remaining)
+					break
+				data = await asyncio.wait_for(reader.read(65536), remaining)
+				if not data:
+					break
+				self.count(data)
+		except asyncio.TimeoutError:
+			pass
+		writer.close()
+
+	def count(self, data):
+		if self.kind == 'sse':
+			self.messages += data.count(b'\n\n')
+			return
+		# Server frames are unmasked, so only the length fields need parsing
+		self.buffer += data
+		while len(self.buffer) >= 2:
+			length = self.buffer[1] & 0x7f
+			header = 2
+			if length == 126:
+				header = 4
+				length = int.from_bytes(self.buffer[2:4], 'big')
+			elif length == 127:
+				header = 10
+				length = int.from_bytes(self.buffer[2:10], 'big')
+			if len(self.buffer) < header + length:
+				break
+			self.buffer = self.buffer[header + length:]
+			self.messages += 1
+
+
+def cpu_seconds(pid):
+	"""Returns the user plus system CPU time of a process, None where /proc is missing"""
+	try:
+		with open(f"/proc/{pid}/stat") as stat:
+			fields = stat.read().rsplit(')', 1)[1].split()
+		return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+	except OSError:
+		return None
+
+
+async def fetch_json(host, port, path):
+	reader, writer = await asyncio.open_connection(host, port)
+	writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+	response = await reader.read()
+	writer.close()
+	return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+async def run_swarm(host, port, clients, slow, duration):
+	kinds = ('sse', 'text', 'binary')
+	swarm = [SwarmClient(kinds[i % len(kinds)], slow=i < slow) for i in range(clients)]
+	# Connect in batches so the listen backlog is not overrun
+	tasks = []
+	for start in range(0, len(swarm), 500):
+		tasks.extend(asyncio.ensure_future(client.run(host, port, duration)) for client in swarm[start:start + 500])
+		await asyncio.sleep(0.05)
+	await asyncio.gather(*tasks)
+	return swarm, await fetch_json(host, port, '/stats')
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Connect a swarm of local clients to a live feed server and report throughput")
+	parser.add_argument('--clients', type=int, default=2000, help="Number of subscribers, split between SSE, WebSocket text and binary")
+	parser.add_argument('--slow', type=int, default=10, help="Subscribers that stop reading")
+	parser.add_argument('--duration', type=float, default=10, help="Seconds each subscriber stays connected")
+	parser.add_argument('--interval', type=float, default=0.25, help="Seconds between snapshots on the server")
+	parser.add_argument('--port', type=int, default=8765)
+	args = parser.parse_args()
+
+	host = '127.0.0.1'
+	server = subprocess.Popen(
+		[sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'live_server.py'), f"{host}:{args.port}", '--interval', str(args.interval)],
+		stdout=subprocess.DEVNULL
+	)
+	try:
+		time.sleep(1)
+		cpu_before = cpu_seconds(server.pid)
+		started = time.monotonic()
+		swarm, stats = asyncio.run(run_swarm(host, args.port, args.clients, args.slow, args.duration))
+		elapsed = time.monotonic() - started
+		cpu_after = cpu_seconds(server.pid)
+	finally:
+		server.terminate()
+		server.wait()
+
+	normal = [client.messages for client in swarm if not client.slow]
+	delivered = sum(client.messages for client in swarm)
+	print(f"{args.clients} subscribers ({args.slow} slow) for {elapsed:.1f} s")
+	print(f"Messages per normal subscriber: min {min(normal)}, max {max(normal)}")
+	print(f"Messages delivered: {delivered} ({delivered / elapsed:,.0f}/s)")
+	print(f"Server stats: {stats}")
+	if cpu_before is not None:
+		print(f"Server CPU: {cpu_after - cpu_before:.2f} s ({(cpu_after - cpu_before) / elapsed:.0%} of one core)")
\ No newline at end of file
@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import base64
+import datetime
+import hashlib
+import json
+import socket
+import struct
+import urllib.parse
+import constants
+
+# Binary WebSocket messages, all little-endian:
+#   snapshot:   type 1, int64 microseconds from the zero date, then for each
+#               level uint8 hexagram, uint8 moving line, float32 seconds to
+#               the next change
+#   transition: type 2, int64 microseconds from the zero date, then uint8
+#               level, old hexagram, new hexagram, old line, new line
+SNAPSHOT_HEADER = struct.Struct('<Bq')
+SNAPSHOT_LEVEL = struct.Struct('<BBf')
+TRANSITION = struct.Struct('<BqBBBBB')
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def parse_address(address):
+	"""Parses "host:port" or ":port" into (host, port), the host defaulting to localhost"""
+	host, _, port = address.rpartition(':')
+	return host or '127.0.0.1', int(port)
+
+
+def websocket_frame(payload, binary=False):
+	"""Returns an unmasked, unfragmented server to client WebSocket frame"""
+	header = bytearray([0x82 if binary else 0x81])
+	if len(payload) < 126:
+		header.append(len(payload))
+	elif len(payload) < 65536:
+		header.append(126)
+		header += struct.pack('>H', len(payload))
+	else:
+		header.append(127)
+		header += struct.pack('>Q', len(payload))
+	return bytes(header) + payload
+
+
+class LiveMessage:
+	"""One message encoded once for every kind of client"""
+	__slots__ = ('json', 'sse', 'websocket_text', 'websocket_binary')
+
+	def __init__(self, data, binary):
+		self.json = data
+		self.sse = b'data: ' + data + b'\n\n'
+		self.websocket_text = websocket_frame(data)
+		self.websocket_binary = websocket_frame(binary, binary=True)
+
+
+class LiveClient:
+	"""A connected viewer with its own bounded queue of pending messages"""
+	def __init__(self, writer, kind, queue_size):
+		self.writer = writer
+		self.kind = kind  # Attribute of LiveMessage this client is sent
+		self.queue = asyncio.Queue(queue_size)
+		self.dropped = 0
+		self.task = None
+
+	def push(self, message):
+		"""Queues a message, dropping the oldest one if the client is behind"""
+		if self.queue.full():
+			self.queue.get_nowait()
+			self.dropped += 1
+		self.queue.put_nowait(message)
+
+
+class LiveServer:
+	"""
+	Streams hexagram snapshots and transitions to Server-Sent Events clients on
+	/events and WebSocket clients on /ws (add ?format=binary for binary
+	messages). /snapshot returns the current snapshot once and /stats the
+	counters. Every message is
+	encoded once per tick and shared by all clients.
+	"""
+	def __init__(self, hexagram_calculator, snapshot_cache, scheduler, host, port):
+		self.hexagram_calculator = hexagram_calculator
+		self.snapshot_cache = snapshot_cache
+		self.scheduler = scheduler
+		self.host = host
+		self.port = port
+		self.server = None
+		self.clients = set()
+		self.last_tick = None
+		self.counters = {'connections': 0, 'messages': 0, 'dropped': 0}
+
+	async def start(self):
+		self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=4096)
+		self.port = self.server.sockets[0].getsockname()[1]
+
+	async def run(self):
+		"""Publishes a snapshot every LIVE_SERVER_INTERVAL and at every change, until cancelled"""
+		if self.server is None:
+			await self.start()
+		try:
+			while not constants.EXIT_FLAG:
+				self.publish_tick(datetime.datetime.now())
+				await self.scheduler.sleep(range(1, 7), constants.LIVE_SERVER_INTERVAL)
+		finally:
+			self.server.close()
+			self.server = None
+			tasks = [client.task for client in self.clients]
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+
+	def publish_tick(self, current_datetime):
+		zero_datetime = constants.ZERO_DATETIME
+		last_tick = self.last_tick
+		self.last_tick = current_datetime
+		if last_tick is not None and last_tick < current_datetime:
+			transitions = self.hexagram_calculator.iter_transitions(
+				last_tick, current_datetime + ONE_MICROSECOND, zero_datetime=zero_datetime
+			)
+			for transition in transitions:
+				self.publish(self.encode_transition(transition, zero_datetime))
+
+		time_to_zero = zero_datetime - current_datetime
+		hexagrams = self.snapshot_cache.get_hexagrams(time_to_zero, zero_datetime)
+		self.publish(self.encode_snapshot(hexagrams, time_to_zero, zero_datetime))
+
+	def publish(self, message):
+		if not self.clients:
+			return
+		self.counters['messages'] += 1
+		for client in self.clients:
+			client.push(message)
+
+	def encode_snapshot(self, hexagrams, time_to_zero, zero_datetime):
+		current_datetime = zero_datetime - time_to_zero
+		data = json.dumps({
+			'type': 'snapshot',
+			'time': current_datetime.isoformat(),
+			'zero_date': zero_datetime.isoformat(),
+			'levels': [
+				{
+					'level': reading.level,
+					'hexagram': reading.hexagram_number,
+					'name': reading.first_name,
+					'line': reading.moving_line,
+					'time_to_next_change': reading.time_to_next_change,
+				}
+				for reading in hexagrams
+			],
+		}, separators=(',', ':')).encode()
+		binary = SNAPSHOT_HEADER.pack(1, -time_to_zero // ONE_MICROSECOND) + b''.join(
+			SNAPSHOT_LEVEL.pack(reading.hexagram_number, reading.moving_line, reading.time_to_next_change)
+			for reading in hexagrams
+		)
+		return LiveMessage(data, binary)
+
+	def encode_transition(self, transition, zero_datetime):
+		timestamp, level, old_hexagram, new_hexagram, old_line, new_line = transition
+		data = json.dumps({
+			'type': 'transition',
+			'time': timestamp.isoformat(),
+			'level': level,
+			'old_hexagram': old_hexagram,
+			'new_hexagram': new_hexagram,
+			'old_line': old_line,
+			'new_line': new_line,
+		}, separators=(',', ':')).encode()
+		binary = TRANSITION.pack(
+			2, (timestamp - zero_datetime) // ONE_MICROSECOND,
+			level, old_hexagram, new_hexagram, old_line, new_line
+		)
+		return LiveMessage(data, binary)
+
+	async def handle_connection(self, reader, writer):
+		try:
+			request = await reader.readuntil(b'\r\n\r\n')
+		except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+			writer.close()
+			return
+
+		request_line, *header_lines = request.decode('latin-1').split('\r\n')
+		parts = request_line.split()
+		headers = {}
+		for line in header_lines:
+			name, _, value = line.partition(':')
+			headers[name.strip().lower()] = value.strip()
+		url = urllib.parse.urlsplit(parts[1] if len(parts) > 1 else '/')
+		query = urllib.parse.parse_qs(url.query)
+
+		if url.path == '/events':
+			writer.write(
+				b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+				b'Cache-Control: no-cache\r\nAccess-Control-Allow-Origin: *\r\n\r\n'
+			)
+			await self.serve_client(reader, writer, 'sse')
+		elif url.path == '/ws' and headers.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in headers:
+			accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode() + WEBSOCKET_GUID).digest())
+			writer.write(
+				b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+				b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+			)
+			kind = 'websocket_binary' if query.get('format') == ['binary'] else 'websocket_text'
+			await self.serve_client(reader, writer, kind)
+		elif url.path in ('/snapshot', '/stats'):
+			if url.path == '/stats':
+				data = json.dumps(self.stats()).encode()
+			else:
+				current_datetime = datetime.datetime.now()
+				zero_datetime = constants.ZERO_DATETIME
+				time_to_zero = zero_datetime - current_datetime
+				hexagrams = self.snapshot_cache.get_hexagrams(time_to_zero, zero_datetime)
+				data = self.encode_snapshot(hexagrams, time_to_zero, zero_datetime).json
+			writer.write(
+				b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nAccess-Control-Allow-Origin: *\r\n'
+				b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(data) + data
+			)
+			await self.close_writer(writer)
+		else:
+			writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+			await self.close_writer(writer)
+
+	async def serve_client(self, reader, writer, kind):
+		# Keep the buffers small, so a slow client backs up into its queue and
+		# loses old frames there instead of getting a long backlog of them
+		writer.transport.set_write_buffer_limits(constants.LIVE_CLIENT_SEND_BUFFER)
+		sock = writer.get_extra_info('socket')
+		if sock is not None:
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, constants.LIVE_CLIENT_SEND_BUFFER)
+		client = LiveClient(writer, kind, constants.LIVE_CLIENT_QUEUE_SIZE)
+		client.task = asyncio.current_task()
+		self.clients.add(client)
+		self.counters['connections'] += 1
+		tasks = (
+			asyncio.ensure_future(self.send_messages(client)),
+			asyncio.ensure_future(self.wait_for_close(reader, kind)),
+		)
+		try:
+			await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+		except asyncio.CancelledError:
+			pass  # The server is shutting down
+		finally:
+			for task in tasks:
+				task.cancel()
+			self.clients.discard(client)
+			self.counters['dropped'] += client.dropped
+			writer.close()
+
+	async def send_messages(self, client):
+		try:
+			while True:
+				message = await client.queue.get()
+				client.writer.write(getattr(message, client.kind))
+				await client.writer.drain()
+		except ConnectionError:
+			pass
+
+	async def wait_for_close(self, reader, kind):
+		"""Returns when the client disconnects, ignoring anything else it sends"""
+		try:
+			while True:
+				data = await reader.read(65536)
+				if not data or (kind != 'sse' and data[0] & 0x0f == 0x8):
+					return
+		except ConnectionError:
+			pass
+
+	async def close_writer(self, writer):
+		try:
+			await writer.drain()
+		except ConnectionError:
+			pass
+		writer.close()
+
+	def stats(self):
+		"""Returns connection and message counters, dropped including connected clients"""
+		stats = dict(self.counters)
+		stats['clients'] = len(self.clients)
+		stats['dropped'] += sum(client.dropped for client in self.clients)
+		return stats
+
+
+if __name__ == "__main__":
+	from hexagram_calculator import HexagramCalculator
+	from main import TransitionScheduler
+	from snapshot_cache import SnapshotCache
+
+	parser = argparse.ArgumentParser(description="Serve the live hexagram feed without the app")
+	parser.add_argument('address', nargs='?', default=':8080', help="host:port or :port to listen on")
+	parser.add_argument('--interval', type=float, default=constants.LIVE_SERVER_INTERVAL, help="Seconds between snapshots")
+	args = parser.parse_args()
+	constants.LIVE_SERVER_INTERVAL = args.interval
+
+	calculator = HexagramCalculator()
+	host, port = parse_address(args.address)
+	server = LiveServer(calculator, SnapshotCache(calculator), TransitionScheduler(calculator), host, port)
+	print(f"Serving on {host}:{port}")
+	try:
+		asyncio.run(server.run())
+	except KeyboardInterrupt:
+		pass
\ No newline at end of file
@@ -1,48 +1,89 @@
+import argparse
+import asyncio
 import threading
-import time
 import signal
 import sys
 import os
+import traceback
 import datetime
-from sound_manager import SoundManager
 from hexagram_calculator import HexagramCalculator
+from live_server import LiveServer, parse_address
+from snapshot_cache import SnapshotCache
 from vrchat_manager import VRChatManager
-from gui_manager import GUIManager
 import constants
 
+class TransitionScheduler:
+	"""Sleeps until the next hexagram or moving line change, or until the refresh interval runs out"""
+	def __init__(self, hexagram_calculator):
+		self.hexagram_calculator = hexagram_calculator
+
+	def next_wake_time(self, levels, refresh_interval):
+		current_datetime = datetime.datetime.now()
+		time_to_zero = constants.ZERO_DATETIME - current_datetime
+		wake_time = current_datetime + datetime.timedelta(seconds=refresh_interval)
+
+		for level, next_change, next_line_change in self.hexagram_calculator.get_next_transitions(time_to_zero, current_datetime):
+			if level in levels:
+				wake_time = min(wake_time, next_change, next_line_change)
+
+		return wake_time
+
+	async def sleep(self, levels, refresh_interval):
+		"""Sleeps until the next change on one of the given levels or refresh_interval seconds"""
+		wake_time = self.next_wake_time(levels, refresh_interval)
+		await asyncio.sleep(max((wake_time - datetime.datetime.now()).total_seconds(), 0))
+
 class HexagramApp:
-	def __init__(self):
+	def __init__(self, headless=False):
+		"""
+		Args:
+			headless: Run only the calculator and the VRChat sender. The GUI
+				(tkinter) and audio (pygame) modules are then never imported.
+		"""
+		self.headless = headless
+		
 		# Initialize constants first
 		constants.ZERO_DATETIME = datetime.datetime(2055, 7, 16)
 		constants.UPDATE_HEXAGRAMS = True
 		constants.EXIT_FLAG = False
 		
-		# Ensure sound directory exists before initializing sound manager
-		if not os.path.exists(constants.SOUNDS_DIR):
-			os.makedirs(constants.SOUNDS_DIR)
-		
-		# Initialize previous hexagrams state
-		current_datetime = datetime.datetime.now()
-		time_to_zero = constants.ZERO_DATETIME - current_datetime
-		
-		self.sound_manager = SoundManager()
 		self.hexagram_calculator = HexagramCalculator()
-		self.vrchat_manager = VRChatManager()
+		self.snapshot_cache = SnapshotCache(self.hexagram_calculator)
+		self.vrchat_manager = VRChatManager(self.hexagram_calculator)
+		self.scheduler = TransitionScheduler(self.hexagram_calculator)
 		
-		# Calculate initial hexagrams before GUI setup
-		initial_hexagrams = self.hexagram_calculator.get_hexagrams(time_to_zero)
-		constants.previous_hexagrams = {}  # Initialize the dictionary
+		self.setup_runtime()
+		self.live_server = None
+		if constants.LIVE_SERVER_ADDRESS:
+			host, port = parse_address(constants.LIVE_SERVER_ADDRESS)
+			self.live_server = LiveServer(self.hexagram_calculator, self.snapshot_cache, self.scheduler, host, port)
+			# Bind before any task runs, so a busy port stops startup instead of the update loops
+			try:
+				self.loop.run_until_complete(self.live_server.start())
+			except OSError as e:
+				print(f"Could not start the live server on {host}:{port}: {e}")
+				self.loop.close()
+				self.vrchat_manager.cleanup()
+				sys.exit(1)
 		
-		for level in range(1, 7):
-			for hexagram in initial_hexagrams:
-				if hexagram[0] == level:  # if this is the hexagram for current level
-					constants.previous_hexagrams[f'level_{level}'] = hexagram[3]  # Store hexagram number
-					moving_line = int((hexagram[5] // (hexagram[1].total_seconds() / 6)) + 1)
-					constants.previous_hexagrams[f'level_{level}_line'] = moving_line
+		if headless:
+			# Nothing else would turn sending on without the GUI
+			constants.SEND_TO_VRCHAT_ENABLED = True
+			self.sound_manager = None
+			self.gui_manager = None
+		else:
+			from sound_manager import SoundManager
+			from gui_manager import GUIManager
+			
+			# Ensure sound directory exists before initializing sound manager
+			if not os.path.exists(constants.SOUNDS_DIR):
+				os.makedirs(constants.SOUNDS_DIR)
+			
+			self.sound_manager = SoundManager(self.hexagram_calculator)
+			self.gui_manager = GUIManager(self.sound_manager, self.hexagram_calculator, self.vrchat_manager)
 		
-		self.gui_manager = GUIManager(self.sound_manager, self.hexagram_calculator, self.vrchat_manager)
+		self.exit_event = threading.Event()
 		
-		self.setup_threads()
 		self.setup_signal_handlers()
 
 	def update_zero_datetime(self, new_datetime):
@@ -63,70 +104,161 @@ class HexagramApp:
 				# Force an immediate update of the display
 				current_datetime = datetime.datetime.now()
 				time_to_zero = constants.ZERO_DATETIME - current_datetime
-				hexagrams = self.hexagram_calculator.get_hexagrams(time_to_zero)
-				self.gui_manager.update_display(hexagrams, time_to_zero)
+				if self.gui_manager is not None:
+					hexagrams = self.snapshot_cache.get_hexagrams(time_to_zero)
+					self.sound_manager.cancel_cues()
+					self.gui_manager.submit_snapshot(hexagrams, time_to_zero)
 				return True
 			return False
 		except ValueError:
 			return False
 
-	def setup_threads(self):
-		self.vrchat_thread = threading.Thread(target=self.vrchat_update_loop)
-		self.gui_thread = threading.Thread(target=self.gui_update_loop)
-		
-		self.vrchat_thread.daemon = True
-		self.gui_thread.daemon = True
+	def setup_runtime(self):
+		"""Creates the asyncio loop that runs every update task on one worker thread"""
+		self.loop = asyncio.new_event_loop()
+		self.main_task = None
+		self.loop_thread = threading.Thread(target=self.run_event_loop)
+		self.loop_thread.daemon = True
+
+	def run_event_loop(self):
+		asyncio.set_event_loop(self.loop)
+		try:
+			self.loop.run_until_complete(self.run_tasks())
+		finally:
+			self.loop.close()
+
+	async def run_tasks(self):
+		self.main_task = asyncio.current_task()
+		tasks = []
+		if constants.VRCHAT_OUTPUT_MODE in ('chatbox', 'both'):
+			tasks.append(self.keep_running("VRChat chatbox loop", self.vrchat_update_loop))
+		if constants.VRCHAT_OUTPUT_MODE in ('parameters', 'both'):
+			tasks.append(self.keep_running("avatar parameter loop", self.avatar_parameter_loop))
+		if self.gui_manager is not None:
+			tasks.append(self.keep_running("GUI update loop", self.gui_update_loop))
+			tasks.append(self.keep_running("audio update loop", self.audio_update_loop))
+		if self.live_server is not None:
+			tasks.append(self.keep_running("live server", self.live_server.run))
+		try:
+			await asyncio.gather(*tasks)
+		except asyncio.CancelledError:
+			pass
+
+	async def keep_running(self, name, update_loop):
+		"""Runs an update loop, restarting it after an error so that the other loops keep going"""
+		while not constants.EXIT_FLAG:
+			try:
+				await update_loop()
+				return
+			except Exception as e:
+				print(f"Error in {name}, restarting it: {e}")
+				traceback.print_exc()
+				await asyncio.sleep(1)
+
+	def stop_event_loop(self):
+		"""Cancels every task, safe to call from any thread"""
+		if self.loop.is_closed():
+			return
+		def cancel():
+			if self.main_task is not None:
+				self.main_task.cancel()
+			else:
+				self.loop.stop()
+		try:
+			self.loop.call_soon_threadsafe(cancel)
+		except RuntimeError:
+			pass  # The loop closed in the meantime
 
 	def setup_signal_handlers(self):
 		signal.signal(signal.SIGINT, self.signal_handler)
 		signal.signal(signal.SIGTERM, self.signal_handler)
-		self.gui_manager.root.protocol("WM_DELETE_WINDOW", self.cleanup)
+		if self.gui_manager is not None:
+			self.gui_manager.root.protocol("WM_DELETE_WINDOW", self.cleanup)
 
-	def vrchat_update_loop(self):
+	async def vrchat_update_loop(self):
 		while not constants.EXIT_FLAG and constants.UPDATE_HEXAGRAMS:
 			current_datetime = datetime.datetime.now()
-			time_to_zero = constants.ZERO_DATETIME - current_datetime
-			hexagrams = self.hexagram_calculator.get_hexagrams(time_to_zero)
+			zero_datetime = constants.ZERO_DATETIME
+			time_to_zero = zero_datetime - current_datetime
+			hexagrams = self.snapshot_cache.get_hexagrams(time_to_zero, zero_datetime)
 			
-			if constants.CURRENT_PAGE == 1:
-				message = self.vrchat_manager.format_message_page1(hexagrams, time_to_zero)
-				self.vrchat_manager.send_message(message)
-				time.sleep(1.9775390625)
-			else:
-				message = self.vrchat_manager.format_message_page2(hexagrams, time_to_zero)
-				self.vrchat_manager.send_message(message)
+			# Format each page once, however many targets show it
+			pages = self.vrchat_manager.pages()
+			self.vrchat_manager.send_pages({
+				page: self.vrchat_manager.format_page(page, hexagrams, time_to_zero)
+				for page in pages
+			})
+			levels = set().union(*(self.vrchat_manager.page_levels(page) for page in pages))
 			
-			time.sleep(2)
+			await self.scheduler.sleep(levels, constants.VRCHAT_SEND_INTERVAL)
+
+	async def avatar_parameter_loop(self):
+		levels = constants.AVATAR_PARAMETER_LEVELS
+		while not constants.EXIT_FLAG and constants.UPDATE_HEXAGRAMS:
+			current_datetime = datetime.datetime.now()
+			zero_datetime = constants.ZERO_DATETIME
+			time_to_zero = zero_datetime - current_datetime
+			hexagrams = self.snapshot_cache.get_hexagrams(time_to_zero, zero_datetime)
+			self.vrchat_manager.send_parameters(hexagrams)
+			await self.scheduler.sleep(levels, constants.AVATAR_PARAMETER_INTERVAL)
 
-	def gui_update_loop(self):
+	async def gui_update_loop(self):
 		while not constants.EXIT_FLAG and constants.UPDATE_HEXAGRAMS:
 			current_datetime = datetime.datetime.now()
-			time_to_zero = constants.ZERO_DATETIME - current_datetime
-			hexagrams = self.hexagram_calculator.get_hexagrams(time_to_zero)
-			self.gui_manager.update_display(hexagrams, time_to_zero)
-			time.sleep(0.05)
+			zero_datetime = constants.ZERO_DATETIME
+			time_to_zero = zero_datetime - current_datetime
+			hexagrams = self.snapshot_cache.get_hexagrams(time_to_zero, zero_datetime)
+			self.gui_manager.submit_snapshot(hexagrams, time_to_zero)
+			await self.scheduler.sleep(range(1, 7), constants.GUI_REFRESH_INTERVAL)
+
+	async def audio_update_loop(self):
+		while not constants.EXIT_FLAG and constants.UPDATE_HEXAGRAMS:
+			# Cues are queued ahead of time, so this only has to keep the queue
+			# topped up and notice sound menu or zero date changes
+			self.sound_manager.update_cues(datetime.datetime.now())
+			await asyncio.sleep(constants.AUDIO_REFRESH_INTERVAL)
 
 	def run(self):
-		self.vrchat_thread.start()
-		self.gui_thread.start()
+		self.loop_thread.start()
+		if self.headless:
+			# Keep the main thread free for the signal handlers. The wait is
+			# timed since an untimed one ignores Ctrl+C on Windows
+			while not self.exit_event.wait(1):
+				if not self.loop_thread.is_alive():
+					print("Update loop stopped, exiting")
+					self.cleanup()
+			return
 		self.gui_manager.run()
 
 	def cleanup(self):
 		constants.EXIT_FLAG = True
 		constants.UPDATE_HEXAGRAMS = False
+		self.exit_event.set()
 		
-		if self.vrchat_thread.is_alive():
-			self.vrchat_thread.join()
-		if self.gui_thread.is_alive():
-			self.gui_thread.join()
+		self.stop_event_loop()
+		if self.loop_thread.is_alive():
+			self.loop_thread.join()
 			
-		self.sound_manager.cleanup()
-		self.gui_manager.cleanup()
+		self.vrchat_manager.cleanup()
+		if self.sound_manager is not None:
+			self.sound_manager.cleanup()
+		if self.gui_manager is not None:
+			self.gui_manager.cleanup()
 		sys.exit(0)
 
 	def signal_handler(self, sig, frame):
 		self.cleanup()
 
 if __name__ == "__main__":
-	app = HexagramApp()
+	parser = argparse.ArgumentParser(description="Hexagrams Live")
+	parser.add_argument('--headless', action='store_true', help="Run without GUI or audio, only sending to VRChat")
+	parser.add_argument('--page', type=int, choices=[1, 2], default=constants.CURRENT_PAGE, help="VRChat message page")
+	parser.add_argument('--output', choices=['chatbox', 'parameters', 'both'], default=constants.VRCHAT_OUTPUT_MODE, help="Send chatbox text, avatar parameters or both")
+	parser.add_argument('--serve', metavar='[HOST]:PORT', default=constants.LIVE_SERVER_ADDRESS, help="Stream the live feed over WebSocket and Server-Sent Events")
+	args = parser.parse_args()
+	constants.CURRENT_PAGE = args.page
+	constants.VRCHAT_OUTPUT_MODE = args.output
+	constants.LIVE_SERVER_ADDRESS = args.serve
+	
+	app = HexagramApp(headless=args.headless)
 	app.run()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import re
+import string
+import constants
+
+# Page fields, as Python expressions over the locals of the compiled function
+PAGE_FIELDS = {
+	'date': 'current_datetime.date()',
+	'time': 'current_datetime.time()',
+	'zero_date': 'zero_datetime',
+	'days_to_zero': 'seconds_to_zero / 86400',
+	# Integer days, round() never gives the "-0" that a :.0f spec shows just after the zero date
+	'rounded_days': 'round(seconds_to_zero / 86400)',
+	# Rounded rather than given a format spec, so trailing zeros are dropped
+	'rounded_days_to_zero': 'round(seconds_to_zero / 86400, 4)',
+	'hours_to_zero': 'int((seconds_to_zero % 86400) // 3600)',
+}
+
+# Level fields, written L<level>.<field> in templates. "reading" and "next"
+# stand for that level's reading and its time_to_next_change.
+LEVEL_FIELDS = {
+	'number': 'reading.hexagram_number',
+	'name': 'reading.hexagram_name',
+	'first_name': 'reading.first_name',
+	'line': 'reading.moving_line',
+	'cycle_name': 'reading.cycle_name',
+	'next_ms': 'int(abs(next * 1000))',
+	'next_days': 'int(abs(next // 86400))',
+	'next_total_hours': 'int(abs(next // 3600))',
+	'next_hours': 'int(abs(next // 3600)) % 24',
+	'next_minutes': 'int(abs((next % 3600) // 60))',
+	'next_seconds': 'int(abs(next % 60))',
+}
+
+# Level fields that only depend on the cycle length, formatted once at compile time
+STATIC_LEVEL_FIELDS = {
+	'cycle_seconds': lambda cycle_length: cycle_length.total_seconds(),
+	'cycle_hours': lambda cycle_length: cycle_length.total_seconds() / 3600,
+	'cycle_days': lambda cycle_length: cycle_length.total_seconds() / 86400,
+}
+
+# Locals the compiled function sets up, in order, only when a field uses them
+PRELUDE = [
+	('seconds_to_zero', 'time_to_zero.total_seconds()'),
+	('current_datetime', 'zero_datetime - time_to_zero'),
+]
+
+LEVEL_FIELD_PATTERN = re.compile(r'L([1-6])\.(\w+)$')
+NAME_PATTERN = re.compile(r'\b(reading|next)\b')
+
+
+def field_expression(field, levels):
+	"""Returns the Python expression for a template field, adding the levels it reads to levels"""
+	if field in PAGE_FIELDS:
+		return PAGE_FIELDS[field]
+	match = LEVEL_FIELD_PATTERN.match(field)
+	if match is None or match.group(2) not in LEVEL_FIELDS:
+		raise ValueError(f"Unknown message field: {field}")
+	level = int(match.group(1))
+	levels.add(level)
+	return NAME_PATTERN.sub(lambda name: f"{name.group(1)}_{level}", LEVEL_FIELDS[match.group(2)])
+
+
+def static_field_text(field, spec, conversion, cycles):
+	"""Returns the formatted text of a STATIC_LEVEL_FIELDS field, None for other fields"""
+	match = LEVEL_FIELD_PATTERN.match(field)
+	if match is None or match.group(2) not in STATIC_LEVEL_FIELDS:
+		return None
+	value = STATIC_LEVEL_FIELDS[match.group(2)](cycles[int(match.group(1)) - 1])
+	if conversion:
+		value = {'r': repr, 's': str, 'a': ascii}[conversion](value)
+	return format(value, spec)
+
+
+class MessageLayout:
+	"""
+	Page layout compiled from line templates into one Python function. Templates
+	use str.format syntax with the names in PAGE_FIELDS and L<level>.<name> for
+	LEVEL_FIELDS or STATIC_LEVEL_FIELDS, e.g. "L 3: {L3.number}-{L3.first_name}".
+	Args:
+		lines: Line templates
+		cycles: Cycle length timedelta of each level, from HexagramCalculator.cycles
+	The levels whose readings the layout shows are in self.levels.
+	"""
+	def __init__(self, lines, cycles):
+		self.lines = list(lines)
+		self.cycles = list(cycles)
+		levels = set()
+		formatter = string.Formatter()
+		line_sources = []
+		for line in self.lines:
+			parts = []
+			for literal, field, spec, conversion in formatter.parse(line):
+				parts.append(literal.replace('{', '{{').replace('}', '}}'))
+				if field is None:
+					continue
+				if '{' in spec:
+					raise ValueError(f"Nested fields are not supported: {line}")
+				text = static_field_text(field, spec, conversion, self.cycles)
+				if text is not None:
+					parts.append(text.replace('{', '{{').replace('}', '}}'))
+					continue
+				parts.append('{%s%s%s}' % (
+					field_expression(field, levels),
+					'!' + conversion if conversion else '',
+					':' + spec if spec else ''
+				))
+			line_sources.append(''.join(parts))
+
+		# Each page renders as a single f-string
+		body = []
+		used = ''.join(line_sources)
+		for name, expression in PRELUDE:
+			if re.search(rf'\b{name}\b', used):
+				body.append(f"{name} = {expression}")
+		for level in sorted(levels):
+			body.append(f"reading_{level} = hexagrams[{level}]")
+			if f"next_{level}" in used:
+				body.append(f"next_{level} = reading_{level}.time_to_next_change")
+		page = 'f' + repr(''.join(source + '\n' for source in line_sources))
+		line_list = '[' + ', '.join('f' + repr(source) for source in line_sources) + ']'
+		source = "def render(hexagrams, time_to_zero, zero_datetime):\n"
+		source += ''.join(f"\t{statement}\n" for statement in body)
+		self.source = source + f"\treturn {page}\n" + source.replace("def render(", "def render_lines(", 1) + f"\treturn {line_list}\n"
+
+		namespace = {}
+		exec(compile(self.source, '<message layout>', 'exec'), namespace)
+		self.levels = frozenset(levels)
+		self.render_page = namespace['render']
+		self.render_page_lines = namespace['render_lines']
+
+	def render(self, hexagrams, time_to_zero, zero_datetime=None):
+		"""Returns the page as one string, each line ending with a newline"""
+		if zero_datetime is None:
+			zero_datetime = constants.ZERO_DATETIME
+		return self.render_page(hexagrams, time_to_zero, zero_datetime)
+
+	def render_lines(self, hexagrams, time_to_zero, zero_datetime=None):
+		"""Returns the page as a list of lines"""
+		if zero_datetime is None:
+			zero_datetime = constants.ZERO_DATETIME
+		return self.render_page_lines(hexagrams, time_to_zero, zero_datetime)
+
+
+compiled_layouts = {}
+
+
+def get_layout(name, cycles):
+	"""Returns the compiled constants.MESSAGE_LAYOUTS entry, recompiling it if it was edited"""
+	lines = constants.MESSAGE_LAYOUTS[name]
+	layout = compiled_layouts.get(name)
+	if layout is None or layout.lines != lines or layout.cycles != cycles:
+		layout = compiled_layouts[name] = MessageLayout(lines, cycles)
+	return layout
\ No newline at end of file
@@ -0,0 +1,101 @@
+import argparse
+import datetime
+import socket
+import threading
+import time
+from pythonosc import osc_message, udp_client
+from hexagram_calculator import HexagramCalculator
+from vrchat_manager import CachedOSCClient, VRChatManager
+import constants
+
+
+class UDPReceiver:
+	"""Local stand-in for VRChat that collects the OSC messages sent to it"""
+	def __init__(self, address="127.0.0.1", port=0):
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+		self.socket.bind((address, port))
+		self.socket.settimeout(0.2)
+		self.address, self.port = self.socket.getsockname()
+		self.datagrams = []
+		self.running = True
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def run(self):
+		while self.running:
+			try:
+				self.datagrams.append(self.socket.recv(65536))
+			except socket.timeout:
+				pass
+
+	def messages(self):
+		"""Returns the received (address, params) pairs"""
+		return [
+			(message.address, message.params)
+			for message in map(osc_message.OscMessage, list(self.datagrams))
+		]
+
+	def wait_for(self, count, timeout=5):
+		deadline = time.monotonic() + timeout
+		while len(self.datagrams) < count and time.monotonic() < deadline:
+			time.sleep(0.01)
+		return len(self.datagrams) >= count
+
+	def close(self):
+		self.running = False
+		self.thread.join()
+		self.socket.close()
+
+
+def page2_messages(count):
+	"""Returns count page 2 messages for consecutive level 1 moving lines"""
+	calculator = HexagramCalculator()
+	# Only the formatters are needed, so skip starting the sender thread
+	manager = VRChatManager.__new__(VRChatManager)
+	manager.hexagram_calculator = calculator
+	start = datetime.datetime.now()
+	line_seconds = calculator.cycle_seconds[0] / 6
+	messages = []
+	for i in range(count):
+		time_to_zero = constants.ZERO_DATETIME - (start + datetime.timedelta(seconds=i * line_seconds))
+		messages.append(manager.format_message_page2(calculator.get_hexagrams(time_to_zero), time_to_zero))
+	return messages
+
+
+def benchmark(client, messages, repeat):
+	"""Returns messages sent per second"""
+	started = time.perf_counter()
+	for _ in range(repeat):
+		for message in messages:
+			client.send_message("/chatbox/input", [message, True, False])
+	return repeat * len(messages) / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Measure OSC encode and send throughput against a local receiver")
+	parser.add_argument('--messages', type=int, default=384, help="Distinct page 2 messages")
+	parser.add_argument('--repeat', type=int, default=50, help="Times each message is sent")
+	args = parser.parse_args()
+
+	messages = page2_messages(args.messages)
+	receiver = UDPReceiver()
+	try:
+		clients = [
+			("SimpleUDPClient", udp_client.SimpleUDPClient(receiver.address, receiver.port)),
+			("CachedOSCClient", CachedOSCClient(receiver.address, receiver.port, max_entries=args.messages)),
+		]
+		for name, client in clients:
+			del receiver.datagrams[:]
+			rate = benchmark(client, messages, args.repeat)
+			receiver.wait_for(len(messages) * args.repeat, timeout=1)
+			print(f"{name}: {rate:,.0f} messages/s, {len(receiver.datagrams)} received")
+
+		# Both clients must produce the same datagrams
+		del receiver.datagrams[:]
+		for _, client in clients:
+			client.send_message("/chatbox/input", [messages[0], True, False])
+		receiver.wait_for(2)
+		print("Datagrams match:", len(set(receiver.datagrams)) == 1)
+	finally:
+		receiver.close()
\ No newline at end of file
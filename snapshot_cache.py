@@ -0,0 +1,68 @@
+import collections
+import threading
+import constants
+from hexagram_calculator import CYCLE_TICKS, ONE_MICROSECOND, TICKS_PER_SECOND
+
+# Buckets must divide a level 1 moving line (675 ticks), so that no bucket
+# spans a hexagram or moving line change. 75 ticks is about 37 ms.
+LINE_TICKS = CYCLE_TICKS[0] // 6
+DEFAULT_BUCKET_TICKS = 75
+
+
+class SnapshotCache:
+	"""Thread-safe LRU cache of get_hexagrams snapshots keyed by zero date and tick bucket"""
+	def __init__(self, hexagram_calculator, bucket_ticks=DEFAULT_BUCKET_TICKS, max_entries=16):
+		if LINE_TICKS % bucket_ticks:
+			raise ValueError(f"bucket_ticks must divide {LINE_TICKS}")
+		self.hexagram_calculator = hexagram_calculator
+		self.bucket_ticks = bucket_ticks
+		self.max_entries = max_entries
+		self.snapshots = collections.OrderedDict()
+		self.zero_datetime = None
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get_hexagrams(self, time_to_zero, zero_datetime=None):
+		"""
+		Returns the snapshot for time_to_zero, shared by every caller in the same bucket
+		Args:
+			time_to_zero: Zero datetime minus the current datetime
+			zero_datetime: Zero datetime time_to_zero was measured from,
+				defaults to constants.ZERO_DATETIME
+		"""
+		if zero_datetime is None:
+			zero_datetime = constants.ZERO_DATETIME
+		microseconds = time_to_zero // ONE_MICROSECOND
+		ticks = abs(microseconds) * TICKS_PER_SECOND // 1000000
+		key = (zero_datetime, microseconds > 0, ticks // self.bucket_ticks)
+
+		with self.lock:
+			if zero_datetime != self.zero_datetime:
+				# Snapshots for the old zero date can never be used again
+				self.snapshots.clear()
+				self.zero_datetime = zero_datetime
+
+			snapshot = self.snapshots.get(key)
+			if snapshot is not None:
+				self.snapshots.move_to_end(key)
+				self.hits += 1
+				return snapshot
+
+			self.misses += 1
+			snapshot = self.hexagram_calculator.get_hexagrams(time_to_zero)
+			self.snapshots[key] = snapshot
+			if len(self.snapshots) > self.max_entries:
+				self.snapshots.popitem(last=False)
+			return snapshot
+
+	def invalidate(self):
+		"""Drops every cached snapshot"""
+		with self.lock:
+			self.snapshots.clear()
+			self.zero_datetime = None
+
+	def stats(self):
+		"""Returns hit, miss and size counters"""
+		with self.lock:
+			return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.snapshots)}
\ No newline at end of file
@@ -1,70 +1,266 @@
+import collections
+import datetime
+import hashlib
+import heapq
+import itertools
+import mmap
+import queue
+import threading
+import time
 import pygame
 import constants
 import os
 
+
+SOUND_FILES = {
+	'level1': "level1.mp3",
+	'level2': "level2.mp3",
+	'level3': "level3.mp3",
+	'level4': "level4.mp3",
+	'level5': "level5.mp3",
+	'level1_line': "level1_line.mp3",
+	'level2_line': "level2_line.mp3",
+	'level3_line': "level3_line.mp3",
+	'level4_line': "level4_line.mp3",
+	'level5_line': "level5_line.mp3"
+}
+
+
+def load_sound(sound_path):
+	"""
+	Returns a Sound for a file, reading the decoded PCM from the cache if a
+	previous launch already decoded it for the same mixer format
+	"""
+	with open(sound_path, 'rb') as sound_file:
+		digest = hashlib.sha256(sound_file.read())
+	digest.update(repr(pygame.mixer.get_init()).encode())
+	cache_path = os.path.join(constants.CACHE_DIR, 'sounds', digest.hexdigest() + '.pcm')
+
+	if os.path.exists(cache_path):
+		with open(cache_path, 'rb') as cache_file, mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as pcm:
+			return pygame.mixer.Sound(buffer=pcm)
+
+	sound = pygame.mixer.Sound(sound_path)
+	try:
+		os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+		temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+		with open(temp_path, 'wb') as cache_file:
+			cache_file.write(sound.get_raw())
+		os.replace(temp_path, cache_path)
+	except OSError as e:
+		print(f"Failed to cache decoded sound {sound_path}: {e}")
+	return sound
+
+
+class CueLatencyStats:
+	"""Time from each cue's target timestamp to the moment its sound started"""
+	def __init__(self, window=1000):
+		self.latencies = collections.deque(maxlen=window)
+		self.played = 0
+		self.skipped = 0
+
+	def record(self, latency):
+		self.latencies.append(latency)
+		self.played += 1
+
+	def summary(self):
+		"""Returns the cue counts and latency percentiles in ms over the last window of cues"""
+		latencies = sorted(self.latencies)
+		if not latencies:
+			return {'played': self.played, 'skipped': self.skipped}
+		return {
+			'played': self.played,
+			'skipped': self.skipped,
+			'mean_ms': sum(latencies) / len(latencies) * 1000,
+			'p50_ms': latencies[len(latencies) // 2] * 1000,
+			'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+			'max_ms': latencies[-1] * 1000,
+		}
+
+
+class AudioScheduler:
+	"""
+	Thread that starts queued sound cues at their target times. Cues are
+	started early by the mixer's output latency, so the sound is heard on the
+	target time rather than one mixer buffer after it.
+	"""
+	# Wake this long before a cue and spin for the rest, since
+	# Condition.wait can oversleep by about a millisecond
+	SPIN_SECONDS = 0.002
+
+	def __init__(self, sound_manager, output_latency=0):
+		self.sound_manager = sound_manager
+		self.output_latency = datetime.timedelta(seconds=output_latency + self.SPIN_SECONDS)
+		self.spin_latency = datetime.timedelta(seconds=output_latency)
+		self.cues = []  # Heap of (target datetime, sequence, sound key)
+		self.sequence = itertools.count()
+		self.stats = CueLatencyStats()
+		self.closed = False
+		self.condition = threading.Condition()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def schedule(self, sound_key, target_datetime):
+		"""Queues a sound to start at a datetime, at once if it has already passed"""
+		with self.condition:
+			heapq.heappush(self.cues, (target_datetime, next(self.sequence), sound_key))
+			self.condition.notify()
+
+	def cancel(self):
+		"""Drops every queued cue"""
+		with self.condition:
+			self.cues.clear()
+			self.condition.notify()
+
+	def pending(self):
+		with self.condition:
+			return len(self.cues)
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.closed:
+					if self.cues:
+						# Wall clock, not monotonic, so cues queued long ahead follow clock adjustments
+						delay = (self.cues[0][0] - self.output_latency - datetime.datetime.now()).total_seconds()
+						if delay <= 0:
+							break
+						self.condition.wait(min(delay, 1))
+					else:
+						self.condition.wait()
+				if self.closed:
+					return
+				target, _, sound_key = heapq.heappop(self.cues)
+
+			start = target - self.spin_latency
+			while datetime.datetime.now() < start:
+				time.sleep(0)
+			if self.sound_manager.play(sound_key):
+				self.stats.record((datetime.datetime.now() + self.spin_latency - target).total_seconds())
+			else:
+				self.stats.skipped += 1
+
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		self.thread.join()
+
+
 class SoundManager:
-	def __init__(self):
+	def __init__(self, hexagram_calculator):
+		self.hexagram_calculator = hexagram_calculator
+		# A small mixer buffer keeps the delay from play() to output low
+		pygame.mixer.pre_init(constants.AUDIO_MIXER_FREQUENCY, -16, 2, constants.AUDIO_MIXER_BUFFER)
 		pygame.mixer.init()
-		self.sound_files = {
-			'level1': "level1.mp3",
-			'level2': "level2.mp3",
-			'level3': "level3.mp3",
-			'level4': "level4.mp3",
-			'level5': "level5.mp3",
-			'level1_line': "level1_line.mp3",
-			'level2_line': "level2_line.mp3",
-			'level3_line': "level3_line.mp3",
-			'level4_line': "level4_line.mp3",
-			'level5_line': "level5_line.mp3"
-		}
+		self.sound_files = SOUND_FILES
 		self.sounds = {}
-		self.load_sounds()
+		self.failed = frozenset()  # Keys whose file could not be loaded, replaced rather than changed
+		# Sync requests for the loader thread, the only thread that loads or frees sounds
+		self.load_queue = queue.Queue()
+		self.loader_thread = threading.Thread(target=self.run_loader, daemon=True)
+		self.loader_thread.start()
 
-	def load_sounds(self):
-		"""Load all sound files"""
-		for key, file_name in self.sound_files.items():
-			try:
-				sound_path = os.path.join(constants.SOUNDS_DIR, file_name)
-				self.sounds[key] = pygame.mixer.Sound(sound_path)
-			except Exception as e:
-				print(f"Error loading sound {file_name}: {e}")
+		# One reserved channel per sound, so a cue never waits for a free
+		# channel or cuts off a different sound
+		pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), len(self.sound_files)))
+		pygame.mixer.set_reserved(len(self.sound_files))
+		self.channels = {key: pygame.mixer.Channel(number) for number, key in enumerate(self.sound_files)}
 
-	def play_level_sound(self, level):
-		"""Play sound for a specific level"""
-		if not constants.AUDIO_PLAYBACK_ALLOWED:
+		frequency, _, _ = pygame.mixer.get_init()
+		self.scheduler = AudioScheduler(self, constants.AUDIO_MIXER_BUFFER / frequency)
+		self.cue_plan = None  # (zero datetime, enabled sound keys) the queued cues were planned for
+		self.planned_until = None
+		self.sync_sounds()
+
+	def sound_wanted(self, sound_key):
+		"""Returns whether the sound menu setting of a sound key is on"""
+		level, _, line = sound_key[len('level'):].partition('_')
+		suffix = '_LINE_ENABLED' if line else '_ENABLED'
+		return getattr(constants, f'PLAY_AUDIO_LEVEL_{level}{suffix}', False)
+
+	def sync_sounds(self):
+		"""Asks the loader thread to load the sounds that were turned on and free the ones turned off"""
+		self.load_queue.put(True)
+
+	def run_loader(self):
+		while self.load_queue.get():
+			for key in self.sound_files:
+				if not self.sound_wanted(key):
+					if key in self.sounds:
+						self.channels[key].stop()
+						self.sounds.pop(key, None)
+				elif key not in self.sounds and key not in self.failed:
+					try:
+						self.sounds[key] = load_sound(os.path.join(constants.SOUNDS_DIR, self.sound_files[key]))
+					except Exception as e:
+						self.failed = self.failed | {key}
+						print(f"Error loading sound {self.sound_files[key]}: {e}")
+
+	def sound_enabled(self, sound_key):
+		"""Returns whether a sound key should play now"""
+		return constants.AUDIO_PLAYBACK_ALLOWED and self.sound_wanted(sound_key)
+
+	def play(self, sound_key):
+		"""Starts a sound on its reserved channel if it is enabled, returns whether it played"""
+		sound = self.sounds.get(sound_key)
+		if sound is None or not self.sound_enabled(sound_key):
+			return False
+		self.channels[sound_key].play(sound)
+		return True
+
+	def update_cues(self, current_datetime):
+		"""
+		Keeps the cues for the next AUDIO_CUE_LOOKAHEAD transitions queued,
+		cancelling and rebuilding them when the zero date or sound settings change
+		"""
+		zero_datetime = constants.ZERO_DATETIME
+		enabled = frozenset(key for key in self.sound_files if key not in self.failed and self.sound_enabled(key))
+		if (zero_datetime, enabled) != self.cue_plan:
+			self.scheduler.cancel()
+			self.cue_plan = (zero_datetime, enabled)
+			self.planned_until = current_datetime
+		lookahead = constants.AUDIO_CUE_LOOKAHEAD
+		if not enabled or self.scheduler.pending() > lookahead // 2:
 			return
 
-		sound_key = f'level{level}'
-		if sound_key in self.sounds:
-			if level == 1 and constants.PLAY_AUDIO_LEVEL_1_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 2 and constants.PLAY_AUDIO_LEVEL_2_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 3 and constants.PLAY_AUDIO_LEVEL_3_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 4 and constants.PLAY_AUDIO_LEVEL_4_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 5 and constants.PLAY_AUDIO_LEVEL_5_ENABLED:
-				self.sounds[sound_key].play()
+		levels = sorted({int(key[len('level')]) for key in enabled})
+		lines = any(key.endswith('_line') for key in enabled)
+		# One cycle of the slowest level always holds a change of every level
+		end = self.planned_until + self.hexagram_calculator.cycles[levels[-1] - 1]
+		transitions = self.hexagram_calculator.iter_transitions(self.planned_until, end, levels, zero_datetime, lines)
+		full = False
+		for timestamp, level, old_hexagram, new_hexagram, old_line, new_line in transitions:
+			# Only stop between timestamps, since planning resumes after planned_until
+			if full and timestamp != self.planned_until:
+				return
+			if old_hexagram != new_hexagram and f'level{level}' in enabled:
+				self.scheduler.schedule(f'level{level}', timestamp)
+			if old_line != new_line and f'level{level}_line' in enabled:
+				self.scheduler.schedule(f'level{level}_line', timestamp)
+			self.planned_until = timestamp
+			full = self.scheduler.pending() >= lookahead
+		self.planned_until = end - datetime.timedelta(microseconds=1)
+
+	def cancel_cues(self):
+		"""Drops the queued cues, they are rebuilt on the next update_cues"""
+		self.cue_plan = None
+		self.scheduler.cancel()
+
+	def play_level_sound(self, level):
+		"""Play sound for a specific level"""
+		self.play(f'level{level}')
 
 	def play_line_sound(self, level):
 		"""Play moving line sound for a specific level"""
-		if not constants.AUDIO_PLAYBACK_ALLOWED:
-			return
+		self.play(f'level{level}_line')
 
-		sound_key = f'level{level}_line'
-		if sound_key in self.sounds:
-			if level == 1 and constants.PLAY_AUDIO_LEVEL_1_LINE_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 2 and constants.PLAY_AUDIO_LEVEL_2_LINE_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 3 and constants.PLAY_AUDIO_LEVEL_3_LINE_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 4 and constants.PLAY_AUDIO_LEVEL_4_LINE_ENABLED:
-				self.sounds[sound_key].play()
-			elif level == 5 and constants.PLAY_AUDIO_LEVEL_5_LINE_ENABLED:
-				self.sounds[sound_key].play()
+	def latency_stats(self):
+		return self.scheduler.stats.summary()
 
 	def cleanup(self):
-		"""Clean up pygame mixer"""
+		"""Stop the scheduler and loader and clean up pygame mixer"""
+		self.scheduler.close()
+		self.load_queue.put(False)
+		self.loader_thread.join()
 		pygame.mixer.quit()
\ No newline at end of file
@@ -0,0 +1,163 @@
+import argparse
+import datetime
+import os
+import time
+import wave
+import pygame
+import constants
+from hexagram_calculator import load_numpy
+from sound_manager import SOUND_FILES, load_sound
+
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+CHUNK_FRAMES = 1 << 16
+
+
+def enabled_sound_keys(levels=None, lines=True):
+	"""
+	Returns the SOUND_FILES keys to render
+	Args:
+		levels: Levels to include, defaults to those turned on in the sound settings
+		lines: Whether moving line sounds are included
+	"""
+	keys = []
+	for key in SOUND_FILES:
+		level, _, line = key[len('level'):].partition('_')
+		if line and not lines:
+			continue
+		if levels is None:
+			suffix = '_LINE_ENABLED' if line else '_ENABLED'
+			if getattr(constants, f'PLAY_AUDIO_LEVEL_{level}{suffix}', False):
+				keys.append(key)
+		elif int(level) in levels:
+			keys.append(key)
+	return keys
+
+
+def iter_cues(hexagram_calculator, start, end, zero_datetime, sounds, frequency):
+	"""Yields (start frame, samples) for every cue between two datetimes, in time order"""
+	levels = sorted({int(key[len('level')]) for key in sounds})
+	lines = any(key.endswith('_line') for key in sounds)
+	for timestamp, level, old_hexagram, new_hexagram, old_line, new_line in hexagram_calculator.iter_transitions(
+		start, end, levels, zero_datetime, lines
+	):
+		frame = (timestamp - start) // ONE_MICROSECOND * frequency // 1000000
+		# Same cues as SoundManager.update_cues: a hexagram change is also a line change
+		if old_hexagram != new_hexagram and f'level{level}' in sounds:
+			yield frame, sounds[f'level{level}']
+		if old_line != new_line and f'level{level}_line' in sounds:
+			yield frame, sounds[f'level{level}_line']
+
+
+def render_soundtrack(hexagram_calculator, start, end, path, zero_datetime=None, sound_keys=None, chunk_frames=CHUNK_FRAMES):
+	"""
+	Mixes the transition sounds between two datetimes into a 16-bit WAV file.
+	The file is written one chunk at a time, so memory use does not grow with
+	the length of the window.
+	Args:
+		hexagram_calculator: Calculator used to walk the transitions
+		start: Datetime the recording starts at
+		end: Datetime the recording ends at (exclusive)
+		path: Output WAV path
+		zero_datetime: Zero datetime to use, defaults to constants.ZERO_DATETIME
+		sound_keys: SOUND_FILES keys to mix, defaults to enabled_sound_keys()
+		chunk_frames: Frames mixed and written at a time
+	Returns:
+		Number of cues mixed
+	"""
+	np = load_numpy()
+	if np is None:
+		raise ImportError("NumPy is required to render soundtracks")
+	if zero_datetime is None:
+		zero_datetime = constants.ZERO_DATETIME
+	if sound_keys is None:
+		sound_keys = enabled_sound_keys()
+
+	if pygame.mixer.get_init() is None:
+		pygame.mixer.init(constants.AUDIO_MIXER_FREQUENCY, -16, 2)
+	frequency, size, channels = pygame.mixer.get_init()
+	if size != -16:
+		raise ValueError(f"Mixer format {size} is not signed 16-bit")
+
+	sounds = {}
+	for key in sound_keys:
+		try:
+			sound = load_sound(os.path.join(constants.SOUNDS_DIR, SOUND_FILES[key]))
+		except Exception as e:
+			print(f"Error loading sound {SOUND_FILES[key]}: {e}")
+			continue
+		sounds[key] = np.frombuffer(sound.get_raw(), dtype=np.int16).reshape(-1, channels).astype(np.int32)
+
+	total_frames = (end - start) // ONE_MICROSECOND * frequency // 1000000
+	if total_frames * channels * 2 > 0xffffffff - 36:
+		raise ValueError("Window is too long for one WAV file, split it into shorter renders")
+	cues = iter_cues(hexagram_calculator, start, end, zero_datetime, sounds, frequency) if sounds else iter(())
+	next_cue = next(cues, None)
+	active = []  # (start frame, samples) of cues still sounding
+	count = 0
+	mix = np.zeros((chunk_frames, channels), dtype=np.int32)
+
+	temp_path = path + '.tmp'
+	try:
+		with wave.open(temp_path, 'wb') as wav:
+			wav.setnchannels(channels)
+			wav.setsampwidth(2)
+			wav.setframerate(frequency)
+			for chunk_start in range(0, total_frames, chunk_frames):
+				chunk_end = min(chunk_start + chunk_frames, total_frames)
+				while next_cue is not None and next_cue[0] < chunk_end:
+					active.append(next_cue)
+					count += 1
+					next_cue = next(cues, None)
+
+				buffer = mix[:chunk_end - chunk_start]
+				buffer.fill(0)
+				sounding = []
+				for cue_start, samples in active:
+					offset = cue_start - chunk_start
+					begin = max(offset, 0)
+					length = min(len(samples) - (begin - offset), len(buffer) - begin)
+					buffer[begin:begin + length] += samples[begin - offset:begin - offset + length]
+					if cue_start + len(samples) > chunk_end:
+						sounding.append((cue_start, samples))
+				active = sounding
+
+				np.clip(buffer, -32768, 32767, out=buffer)
+				wav.writeframes(buffer.astype('<i2').tobytes())
+		os.replace(temp_path, path)
+	finally:
+		# Only left over when mixing or writing failed
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+	return count
+
+
+if __name__ == "__main__":
+	from hexagram_calculator import HexagramCalculator
+
+	parser = argparse.ArgumentParser(description="Render the transition sounds of a time window to a WAV file")
+	parser.add_argument('start', help="Start (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+	parser.add_argument('end', help="End, exclusive (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+	parser.add_argument('output', help="WAV file to write")
+	parser.add_argument('--zero-date', help="Zero date (YYYY-MM-DD), defaults to constants.ZERO_DATETIME")
+	parser.add_argument('--levels', type=int, nargs='+', choices=range(1, 6), help="Levels to include, defaults to the sound settings")
+	parser.add_argument('--no-lines', action='store_true', help="Leave out the moving line sounds")
+	args = parser.parse_args()
+
+	# Decoding needs the mixer but nothing is played, so no audio device is used
+	os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+	start = datetime.datetime.fromisoformat(args.start)
+	end = datetime.datetime.fromisoformat(args.end)
+	zero_datetime = datetime.datetime.strptime(args.zero_date, '%Y-%m-%d') if args.zero_date else None
+
+	started = time.perf_counter()
+	count = render_soundtrack(
+		HexagramCalculator(),
+		start,
+		end,
+		args.output,
+		zero_datetime,
+		enabled_sound_keys(args.levels, not args.no_lines)
+	)
+	elapsed = time.perf_counter() - started
+	seconds = (end - start).total_seconds()
+	print(f"Wrote {args.output}: {count} cues, {seconds:.0f} s of audio in {elapsed:.1f} s ({seconds / elapsed:.0f}x real time)")
\ No newline at end of file
@@ -0,0 +1,209 @@
+import datetime
+import fractions
+import random
+import unittest
+from hexagram_calculator import CYCLE_TICKS, TICKS_PER_SECOND, HexagramCalculator
+
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+ZERO_DATETIME = datetime.datetime(2055, 7, 16)
+
+
+def exact_levels(microseconds):
+	"""(hexagram_number, moving_line) of every level from exact Fraction arithmetic"""
+	seconds = fractions.Fraction(abs(microseconds), 1000000)
+	levels = []
+	for cycle_ticks in CYCLE_TICKS:
+		cycle = fractions.Fraction(cycle_ticks, TICKS_PER_SECOND)
+		cycle_number = seconds // cycle
+		phase = seconds - cycle_number * cycle
+		levels.append((cycle_number % 64 + 1, phase * 6 // cycle + 1))
+	return levels
+
+
+class TickArithmeticTest(unittest.TestCase):
+	def setUp(self):
+		self.calculator = HexagramCalculator()
+		self.random = random.Random(2)
+
+	def test_matches_exact_arithmetic(self):
+		limit = 126 * 366 * 86400 * 1000000
+		for _ in range(5000):
+			microseconds = self.random.randint(-limit, limit)
+			hexagrams = self.calculator.get_hexagrams(datetime.timedelta(microseconds=microseconds))
+			expected = exact_levels(microseconds)
+			self.assertEqual(
+				[(reading.hexagram_number, reading.moving_line) for reading in hexagrams],
+				expected,
+				microseconds
+			)
+
+	def test_level_1_does_not_wrap_before_level_2_changes(self):
+		# The last tick of a level 2 cycle is the last hexagram and line of level 1
+		ticks = CYCLE_TICKS[1] - 1
+		microseconds = -(-ticks * 1000000 // TICKS_PER_SECOND)
+		hexagrams = self.calculator.get_hexagrams(datetime.timedelta(microseconds=microseconds))
+		self.assertEqual((hexagrams[1].hexagram_number, hexagrams[1].moving_line), (64, 6))
+		self.assertEqual(hexagrams[2].hexagram_number, 1)
+
+	def test_batch_matches_get_hexagrams(self):
+		offsets = [self.random.randint(-10 ** 15, 10 ** 15) for _ in range(1000)]
+		batch = self.calculator.get_hexagrams_batch([offset / 1000000 for offset in offsets])
+		for row, offset in enumerate(offsets):
+			hexagrams = self.calculator.get_hexagrams(datetime.timedelta(microseconds=offset))
+			self.assertEqual(
+				[int(number) for number in batch['hexagram_number'][row]],
+				[reading.hexagram_number for reading in hexagrams]
+			)
+			self.assertEqual(
+				[int(line) for line in batch['moving_line'][row]],
+				[reading.moving_line for reading in hexagrams]
+			)
+
+	def test_snapshot_levels(self):
+		hexagrams = self.calculator.get_hexagrams(datetime.timedelta(days=1))
+		self.assertEqual([hexagrams[level].level for level in range(1, 7)], list(range(1, 7)))
+		for level in (0, -1, 7):
+			with self.assertRaises(IndexError):
+				hexagrams[level]
+
+	def test_calculate_moving_line(self):
+		for _ in range(1000):
+			hexagrams = self.calculator.get_hexagrams(datetime.timedelta(microseconds=self.random.randint(1, 10 ** 15)))
+			for reading in hexagrams:
+				self.assertEqual(
+					self.calculator.calculate_moving_line(reading.time_since_last_change, reading.cycle_length),
+					reading.moving_line
+				)
+
+
+
+class TransitionTest(unittest.TestCase):
+	def setUp(self):
+		self.calculator = HexagramCalculator()
+		self.random = random.Random(4)
+
+	def state(self, when):
+		hexagrams = self.calculator.get_hexagrams(ZERO_DATETIME - when)
+		return [(reading.hexagram_number, reading.moving_line) for reading in hexagrams]
+
+	def windows(self):
+		for _ in range(5):
+			start = ZERO_DATETIME + datetime.timedelta(microseconds=self.random.randint(-10 ** 15, 10 ** 15))
+			yield start, start + datetime.timedelta(seconds=20)
+		# Through the zero date, where the tick count turns around
+		yield ZERO_DATETIME - datetime.timedelta(seconds=10), ZERO_DATETIME + datetime.timedelta(seconds=10)
+
+	def test_transitions_are_the_state_changes(self):
+		for start, end in self.windows():
+			transitions = list(self.calculator.iter_transitions(start, end, levels=range(1, 4), zero_datetime=ZERO_DATETIME))
+			self.assertEqual(transitions, sorted(transitions))
+			for timestamp, level, old_hexagram, new_hexagram, old_line, new_line in transitions:
+				self.assertTrue(start < timestamp < end)
+				self.assertNotEqual((old_hexagram, old_line), (new_hexagram, new_line))
+				self.assertEqual(self.state(timestamp - ONE_MICROSECOND)[level - 1], (old_hexagram, old_line))
+				self.assertEqual(self.state(timestamp)[level - 1], (new_hexagram, new_line))
+
+			# Replaying the transitions must give the state at every sampled moment
+			replayed = self.state(start)
+			pending = iter(transitions)
+			transition = next(pending, None)
+			when = start
+			while when < end:
+				while transition is not None and transition[0] <= when:
+					replayed[transition[1] - 1] = (transition[3], transition[5])
+					transition = next(pending, None)
+				self.assertEqual(self.state(when)[:3], replayed[:3], when)
+				when += datetime.timedelta(microseconds=997)
+
+	def test_hexagram_changes_only(self):
+		start = ZERO_DATETIME - datetime.timedelta(hours=1)
+		transitions = list(self.calculator.iter_transitions(
+			start, start + datetime.timedelta(hours=2), levels=[1, 2], zero_datetime=ZERO_DATETIME, lines=False
+		))
+		self.assertTrue(transitions)
+		for timestamp, level, old_hexagram, new_hexagram, _, _ in transitions:
+			self.assertNotEqual(old_hexagram, new_hexagram)
+			self.assertEqual(self.state(timestamp)[level - 1][0], new_hexagram)
+
+	def test_next_transitions(self):
+		moments = [ZERO_DATETIME + datetime.timedelta(microseconds=self.random.randint(-10 ** 15, 10 ** 15)) for _ in range(300)]
+		moments += [ZERO_DATETIME + datetime.timedelta(microseconds=offset) for offset in (-1000, -1, 0, 1, 1000)]
+		for now in moments:
+			current = self.state(now)
+			for level, next_change, next_line_change in self.calculator.get_next_transitions(ZERO_DATETIME - now, now):
+				self.assertGreater(next_change, now)
+				self.assertEqual(self.state(next_change - ONE_MICROSECOND)[level - 1][0], current[level - 1][0])
+				self.assertNotEqual(self.state(next_change)[level - 1][0], current[level - 1][0])
+				self.assertGreater(next_line_change, now)
+				self.assertEqual(self.state(next_line_change - ONE_MICROSECOND)[level - 1], current[level - 1])
+				self.assertNotEqual(self.state(next_line_change)[level - 1], current[level - 1])
+
+
+class FindTimesTest(unittest.TestCase):
+	def setUp(self):
+		self.calculator = HexagramCalculator()
+		self.random = random.Random(5)
+
+	def matches(self, constraints, when):
+		hexagrams = self.calculator.get_hexagrams(ZERO_DATETIME - when)
+		for level, (hexagram_number, moving_line) in constraints.items():
+			reading = hexagrams[level]
+			if hexagram_number is not None and reading.hexagram_number != hexagram_number:
+				return False
+			if moving_line is not None and reading.moving_line != moving_line:
+				return False
+		return True
+
+	def check(self, constraints, start, end):
+		intervals = self.calculator.find_times(constraints, start, end, zero_datetime=ZERO_DATETIME)
+		for (interval_start, interval_end), following in zip(intervals, intervals[1:] + [None]):
+			self.assertTrue(start <= interval_start < interval_end <= end)
+			if following is not None:
+				# Touching intervals are merged
+				self.assertLess(interval_end, following[0])
+			# Exact to the microsecond at both ends
+			self.assertTrue(self.matches(constraints, interval_start))
+			self.assertTrue(self.matches(constraints, interval_end - ONE_MICROSECOND))
+			if interval_start > start:
+				self.assertFalse(self.matches(constraints, interval_start - ONE_MICROSECOND))
+			if interval_end < end:
+				self.assertFalse(self.matches(constraints, interval_end))
+
+		# Moments between the intervals must not match
+		when = start
+		step = (end - start) / 3000
+		while when < end:
+			inside = any(interval_start <= when < interval_end for interval_start, interval_end in intervals)
+			self.assertEqual(self.matches(constraints, when), inside, (constraints, when))
+			when += step
+		return intervals
+
+	def random_constraints(self, levels):
+		constraints = {}
+		for level in self.random.sample(levels, self.random.randint(1, len(levels))):
+			hexagram_number = self.random.choice([None, self.random.randint(1, 64)])
+			moving_line = self.random.choice([None, self.random.randint(1, 6)])
+			constraints[level] = (hexagram_number, moving_line)
+		return constraints
+
+	def test_random_constraints(self):
+		for _ in range(40):
+			start = ZERO_DATETIME + datetime.timedelta(microseconds=self.random.randint(-10 ** 15, 10 ** 15))
+			self.check(self.random_constraints([1, 2, 3]), start, start + datetime.timedelta(hours=6))
+
+	def test_across_zero_date(self):
+		start = ZERO_DATETIME - datetime.timedelta(minutes=10)
+		end = ZERO_DATETIME + datetime.timedelta(minutes=10)
+		# Hexagram 1 of level 2 runs through the zero date as one interval
+		intervals = self.check({2: (1, None)}, start, end)
+		self.assertEqual(len(intervals), 1)
+		for _ in range(20):
+			self.check(self.random_constraints([1, 2]), start, end)
+
+	def test_limit(self):
+		start = ZERO_DATETIME - datetime.timedelta(days=3)
+		intervals = self.calculator.find_times({1: (7, 2)}, start, start + datetime.timedelta(days=1), zero_datetime=ZERO_DATETIME, limit=5)
+		self.assertEqual(len(intervals), 5)
+
+if __name__ == "__main__":
+	unittest.main()
\ No newline at end of file
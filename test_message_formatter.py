@@ -0,0 +1,93 @@
+import datetime
+import random
+import unittest
+import constants
+import message_formatter
+from hexagram_calculator import HexagramCalculator
+
+ZERO_DATETIME = datetime.datetime(2055, 7, 16)
+
+
+def old_page1(hexagrams, time_to_zero, current_date):
+	"""The page 1 formulas from before MESSAGE_LAYOUTS"""
+	days_to_zero = round(time_to_zero.total_seconds() / 86400)
+	hours_to_zero = int((time_to_zero.total_seconds() % 86400) // 3600)
+	message = f"Date: {current_date}\nDays_to_0: {days_to_zero}d{hours_to_zero}h\n"
+	for level in (3, 4, 5):
+		reading = hexagrams[level]
+		summary = f"{reading.hexagram_number}-{reading.first_name} - {reading.moving_line}"
+		if level == 3:
+			total_seconds = int(reading.time_to_next_change)
+			message += f"Change: {total_seconds // 3600:02d}:{(total_seconds % 3600) // 60:02d}:{total_seconds % 60:02d}\n"
+			message += f"L {level}: {reading.cycle_length.total_seconds() / 3600:.2f} {reading.cycle_name}, {summary}\n"
+		else:
+			message += f"L {level}: {reading.cycle_length.total_seconds() / 86400:.0f} d, {summary}\n"
+	return message
+
+
+def old_page2(hexagrams, time_to_zero):
+	"""The page 2 formulas from before MESSAGE_LAYOUTS"""
+	message = ""
+	for level in (1, 2, 3):
+		reading = hexagrams[level]
+		cycle_seconds = reading.cycle_length.total_seconds()
+		time_to_next_change = reading.time_to_next_change
+		if level == 1:
+			message += f"L {level}: {cycle_seconds:.2f} s, {reading.hexagram_number} - {reading.first_name}\n"
+		elif level == 2:
+			minutes = int(abs(time_to_next_change // 60))
+			seconds = int(abs(time_to_next_change % 60))
+			message += f"L 2 change {minutes:02d}:{seconds:02d}\n"
+			message += f"L {level}: {cycle_seconds:.2f} s, {reading.hexagram_number} - {reading.first_name} - {reading.moving_line}\n"
+		else:
+			hours = int(abs(time_to_next_change // 3600))
+			minutes = int(abs((time_to_next_change % 3600) // 60))
+			seconds = int(abs(time_to_next_change % 60))
+			message += f"L 3 change {hours:02d}:{minutes:02d}:{seconds:02d}\n"
+			message += f"L {level}: {cycle_seconds / 3600:.2f} h, {reading.hexagram_number} - {reading.first_name} - {reading.moving_line}\n"
+	return message
+
+
+class ChatboxPageTest(unittest.TestCase):
+	def setUp(self):
+		self.calculator = HexagramCalculator()
+		self.random = random.Random(19)
+
+	def offsets(self):
+		"""Microseconds from the zero date: random ones on both sides and the hours around it"""
+		offsets = [self.random.randint(-10 ** 15, 10 ** 15) for _ in range(3000)]
+		offsets += [self.random.randint(-2 * 86400 * 10 ** 6, 2 * 86400 * 10 ** 6) for _ in range(3000)]
+		offsets += [hours * 3600 * 10 ** 6 for hours in range(-36, 37)]
+		return offsets
+
+	def test_pages_match_old_formulas(self):
+		cycles = self.calculator.cycles
+		page1 = message_formatter.MessageLayout(constants.MESSAGE_LAYOUTS['page1'], cycles)
+		page2 = message_formatter.MessageLayout(constants.MESSAGE_LAYOUTS['page2'], cycles)
+		for offset in self.offsets():
+			current_datetime = ZERO_DATETIME + datetime.timedelta(microseconds=offset)
+			time_to_zero = ZERO_DATETIME - current_datetime
+			hexagrams = self.calculator.get_hexagrams(time_to_zero)
+			self.assertEqual(
+				page1.render(hexagrams, time_to_zero, ZERO_DATETIME),
+				old_page1(hexagrams, time_to_zero, current_datetime.date())
+			)
+			self.assertEqual(page2.render(hexagrams, time_to_zero, ZERO_DATETIME), old_page2(hexagrams, time_to_zero))
+
+	def test_no_negative_zero_days(self):
+		layout = message_formatter.MessageLayout(constants.MESSAGE_LAYOUTS['page1'], self.calculator.cycles)
+		time_to_zero = datetime.timedelta(hours=-3)
+		page = layout.render(self.calculator.get_hexagrams(time_to_zero), time_to_zero, ZERO_DATETIME)
+		self.assertIn("Days_to_0: 0d21h\n", page)
+
+	def test_levels(self):
+		cycles = self.calculator.cycles
+		self.assertEqual(message_formatter.MessageLayout(constants.MESSAGE_LAYOUTS['page1'], cycles).levels, {3, 4, 5})
+		self.assertEqual(message_formatter.MessageLayout(constants.MESSAGE_LAYOUTS['page2'], cycles).levels, {1, 2, 3})
+		# Static fields don't depend on the reading
+		layout = message_formatter.MessageLayout(["{L6.number} {L2.cycle_seconds:.2f}", "{days_to_zero:.1f}"], cycles)
+		self.assertEqual(layout.levels, {6})
+
+
+if __name__ == "__main__":
+	unittest.main()
\ No newline at end of file
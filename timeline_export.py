@@ -0,0 +1,270 @@
+import argparse
+import array
+import csv
+import datetime
+import io
+import itertools
+import json
+import struct
+import sys
+import constants
+from hexagram_calculator import load_numpy
+
+# Columnar layout, all little-endian: header, then row groups of up to
+# --chunk-rows rows. Each row group is a uint32 row count, an int64 column of
+# times (microseconds from the zero date), then for each level a uint8
+# hexagram number column and a uint8 moving line column. Names are not
+# stored, hexagram number - 1 indexes constants.HEXAGRAM_NAMES.
+COLUMNAR_MAGIC = b'HEXCOL01'
+COLUMNAR_HEADER = struct.Struct('<8sqB')  # magic, zero date, level count, then one uint8 per level
+ROW_GROUP_HEADER = struct.Struct('<I')
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+CHUNK_ROWS = 65536
+
+
+def level_cells(levels, encode):
+	"""
+	Returns, for each level, a table of the encoded cells of every
+	(hexagram number, moving line) pair, indexed [hexagram_number][moving_line]
+	"""
+	return [
+		[[encode(level, number, line) for line in range(7)] for number in range(65)]
+		for level in levels
+	]
+
+
+class CSVWriter:
+	"""Writes one row per reading: time, then hexagram, name and line of each level"""
+	def __init__(self, output, zero_datetime, levels):
+		self.output = output
+		self.zero_datetime = zero_datetime
+		self.levels = levels
+		header = ['time']
+		for level in levels:
+			header += [f'L{level}_hexagram', f'L{level}_name', f'L{level}_line']
+		self.output.write(self.csv_line(header))
+		self.cells = level_cells(levels, lambda level, number, line: self.csv_line(
+			[number, constants.HEXAGRAM_NAMES[number - 1], line]
+		)[:-2])
+
+	def csv_line(self, values):
+		line = io.StringIO()
+		csv.writer(line).writerow(values)
+		return line.getvalue()
+
+	def write_chunk(self, offsets, hexagram_columns, line_columns):
+		zero_datetime = self.zero_datetime
+		cells = self.cells
+		self.output.writelines(
+			','.join(itertools.chain(
+				((zero_datetime + datetime.timedelta(microseconds=offset)).isoformat(),),
+				(level_cells[number][line] for level_cells, number, line in zip(cells, numbers, lines))
+			)) + '\r\n'
+			for offset, numbers, lines in zip(offsets, zip(*hexagram_columns), zip(*line_columns))
+		)
+
+
+class JSONLinesWriter:
+	"""Writes one JSON object per reading, {"time": ..., "L1": {"hexagram", "name", "line"}, ...}"""
+	def __init__(self, output, zero_datetime, levels):
+		self.output = output
+		self.zero_datetime = zero_datetime
+		self.cells = level_cells(levels, lambda level, number, line: f'"L{level}":' + json.dumps(
+			{'hexagram': number, 'name': constants.HEXAGRAM_NAMES[number - 1], 'line': line}
+		))
+
+	def write_chunk(self, offsets, hexagram_columns, line_columns):
+		zero_datetime = self.zero_datetime
+		cells = self.cells
+		self.output.writelines(
+			'{"time":"%s",%s}\n' % (
+				(zero_datetime + datetime.timedelta(microseconds=offset)).isoformat(),
+				','.join(level_cells[number][line] for level_cells, number, line in zip(cells, numbers, lines))
+			)
+			for offset, numbers, lines in zip(offsets, zip(*hexagram_columns), zip(*line_columns))
+		)
+
+
+class ColumnarWriter:
+	"""Writes row groups of columns in the layout described at the top of this module"""
+	def __init__(self, output, zero_datetime, levels):
+		self.output = output
+		self.output.write(COLUMNAR_HEADER.pack(
+			COLUMNAR_MAGIC, (zero_datetime - datetime.datetime.min) // ONE_MICROSECOND, len(levels)
+		) + bytes(levels))
+
+	def write_chunk(self, offsets, hexagram_columns, line_columns):
+		self.output.write(ROW_GROUP_HEADER.pack(len(offsets)))
+		array.array('q', offsets).tofile(self.output)
+		for numbers, lines in zip(hexagram_columns, line_columns):
+			self.output.write(bytes(numbers))
+			self.output.write(bytes(lines))
+
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLinesWriter, 'columnar': ColumnarWriter}
+
+
+def iter_columnar(path):
+	"""
+	Reads a columnar export
+	Yields:
+		(zero_datetime, levels, row_group) for each row group, row_group being a
+		dict of 'time' (microseconds from the zero date) and L<level>_hexagram
+		and L<level>_line columns
+	"""
+	with open(path, 'rb') as columnar_file:
+		magic, zero_microseconds, level_count = COLUMNAR_HEADER.unpack(columnar_file.read(COLUMNAR_HEADER.size))
+		if magic != COLUMNAR_MAGIC:
+			raise ValueError(f"Not a columnar timeline export: {path}")
+		zero_datetime = datetime.datetime.min + datetime.timedelta(microseconds=zero_microseconds)
+		levels = list(columnar_file.read(level_count))
+		while True:
+			header = columnar_file.read(ROW_GROUP_HEADER.size)
+			if not header:
+				return
+			rows, = ROW_GROUP_HEADER.unpack(header)
+			row_group = {'time': array.array('q')}
+			row_group['time'].fromfile(columnar_file, rows)
+			for level in levels:
+				row_group[f'L{level}_hexagram'] = columnar_file.read(rows)
+				row_group[f'L{level}_line'] = columnar_file.read(rows)
+			yield zero_datetime, levels, row_group
+
+
+def iter_sampled_chunks(hexagram_calculator, start, end, step, levels, zero_datetime, chunk_rows=CHUNK_ROWS):
+	"""
+	Yields (offsets, hexagram_columns, line_columns) chunks of readings taken
+	every step from start up to end (exclusive), computed with get_hexagrams_batch
+	"""
+	np = load_numpy()
+	step_microseconds = step // ONE_MICROSECOND
+	if step_microseconds <= 0:
+		raise ValueError("Step must be at least one microsecond")
+	first = (start - zero_datetime) // ONE_MICROSECOND
+	last = (end - zero_datetime) // ONE_MICROSECOND
+	columns = [level - 1 for level in levels]
+
+	for chunk_start in range(first, last, step_microseconds * chunk_rows):
+		chunk_end = min(chunk_start + step_microseconds * chunk_rows, last)
+		if np is not None:
+			offsets = np.arange(chunk_start, chunk_end, step_microseconds, dtype=np.int64)
+			# Whole microseconds as seconds are exact in float64 for any realistic window
+			batch = hexagram_calculator.get_hexagrams_batch(-offsets / 1000000)
+			yield (
+				offsets.tolist(),
+				[batch['hexagram_number'][:, column].tolist() for column in columns],
+				[batch['moving_line'][:, column].tolist() for column in columns]
+			)
+		else:
+			offsets = range(chunk_start, chunk_end, step_microseconds)
+			batch = hexagram_calculator.get_hexagrams_batch([-offset / 1000000 for offset in offsets])
+			yield (
+				offsets,
+				[[row[column] for row in batch['hexagram_number']] for column in columns],
+				[[row[column] for row in batch['moving_line']] for column in columns]
+			)
+
+
+def iter_transition_chunks(hexagram_calculator, start, end, levels, zero_datetime, chunk_rows=CHUNK_ROWS):
+	"""
+	Yields (offsets, hexagram_columns, line_columns) chunks with one row for
+	the state at start and one for every moment any of the levels changes
+	"""
+	hexagrams = hexagram_calculator.get_hexagrams(zero_datetime - start)
+	numbers = [hexagrams[level].hexagram_number for level in levels]
+	lines = [hexagrams[level].moving_line for level in levels]
+	positions = {level: position for position, level in enumerate(levels)}
+
+	offsets = [(start - zero_datetime) // ONE_MICROSECOND]
+	hexagram_columns = [[number] for number in numbers]
+	line_columns = [[line] for line in lines]
+	transitions = hexagram_calculator.iter_transitions(start, end, levels, zero_datetime)
+	# Changes of several levels at the same moment are merged into one row
+	for timestamp, changes in itertools.groupby(transitions, key=lambda transition: transition[0]):
+		for _, level, _, new_hexagram, _, new_line in changes:
+			numbers[positions[level]] = new_hexagram
+			lines[positions[level]] = new_line
+		offsets.append((timestamp - zero_datetime) // ONE_MICROSECOND)
+		for column, number in zip(hexagram_columns, numbers):
+			column.append(number)
+		for column, line in zip(line_columns, lines):
+			column.append(line)
+		if len(offsets) >= chunk_rows:
+			yield offsets, hexagram_columns, line_columns
+			offsets = []
+			hexagram_columns = [[] for _ in levels]
+			line_columns = [[] for _ in levels]
+	if offsets:
+		yield offsets, hexagram_columns, line_columns
+
+
+def export_timeline(hexagram_calculator, output, start, end, step=None, levels=range(1, 7), output_format='csv',
+		zero_datetime=None, chunk_rows=CHUNK_ROWS):
+	"""
+	Streams the readings between two datetimes to a file, one chunk at a time
+	Args:
+		hexagram_calculator: Calculator used for the readings
+		output: File to write to, text for csv and jsonl, binary for columnar
+		start: First datetime exported
+		end: End of the export (exclusive)
+		step: Timedelta between rows, or None for one row per transition
+		levels: Levels to include
+		output_format: 'csv', 'jsonl' or 'columnar'
+		zero_datetime: Zero datetime to use, defaults to constants.ZERO_DATETIME
+		chunk_rows: Rows computed and written at a time
+	Returns:
+		Number of rows written
+	"""
+	if zero_datetime is None:
+		zero_datetime = constants.ZERO_DATETIME
+	levels = sorted(set(levels))
+	writer = WRITERS[output_format](output, zero_datetime, levels)
+	if step is None:
+		chunks = iter_transition_chunks(hexagram_calculator, start, end, levels, zero_datetime, chunk_rows)
+	else:
+		chunks = iter_sampled_chunks(hexagram_calculator, start, end, step, levels, zero_datetime, chunk_rows)
+	rows = 0
+	for offsets, hexagram_columns, line_columns in chunks:
+		writer.write_chunk(offsets, hexagram_columns, line_columns)
+		rows += len(offsets)
+	return rows
+
+
+if __name__ == "__main__":
+	from hexagram_calculator import HexagramCalculator
+
+	parser = argparse.ArgumentParser(description="Export the hexagram readings of a time range")
+	parser.add_argument('output', help="File to write, - for standard output (csv and jsonl only)")
+	parser.add_argument('--from', dest='start', required=True, help="First time exported (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+	parser.add_argument('--to', dest='end', required=True, help="End of the export, exclusive (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+	parser.add_argument('--step', type=float, default=60, help="Seconds between rows")
+	parser.add_argument('--transitions', action='store_true', help="Write one row per change of the exported levels instead of every --step")
+	parser.add_argument('--levels', type=int, nargs='+', choices=range(1, 7), default=list(range(1, 7)), help="Levels to include")
+	parser.add_argument('--format', choices=sorted(WRITERS), default='csv', help="Output format")
+	parser.add_argument('--zero-date', help="Zero date (YYYY-MM-DD), defaults to constants.ZERO_DATETIME")
+	parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="Rows computed and written at a time")
+	args = parser.parse_args()
+
+	binary = args.format == 'columnar'
+	if args.output == '-':
+		if binary:
+			parser.error("columnar output needs a file")
+		output = sys.stdout
+	else:
+		output = open(args.output, 'wb' if binary else 'w', buffering=1 << 20, **({} if binary else {'encoding': 'utf-8', 'newline': ''}))
+	try:
+		rows = export_timeline(
+			HexagramCalculator(),
+			output,
+			datetime.datetime.fromisoformat(args.start),
+			datetime.datetime.fromisoformat(args.end),
+			None if args.transitions else datetime.timedelta(seconds=args.step),
+			args.levels,
+			args.format,
+			datetime.datetime.strptime(args.zero_date, '%Y-%m-%d') if args.zero_date else None,
+			args.chunk_rows
+		)
+	finally:
+		if output is not sys.stdout:
+			output.close()
+	print(f"Wrote {rows} rows", file=sys.stderr)
\ No newline at end of file
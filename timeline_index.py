@@ -0,0 +1,223 @@
+import argparse
+import array
+import bisect
+import datetime
+import itertools
+import mmap
+import os
+import random
+import shutil
+import struct
+import tempfile
+import constants
+
+# File layout: header, then one int64 column of record times (microseconds
+# from the zero date), then one 10-byte row per record holding hexagram number
+# and moving line for levels 2-6. Every moving line boundary of levels 3-6 is
+# also a level 2 line boundary, so the records are exactly those boundaries.
+INDEX_LEVELS = range(2, 7)
+INDEX_MAGIC = b'HEXIDX01'
+HEADER = struct.Struct('<8sqqqq')  # magic, zero date, start, end, record count
+ROW_SIZE = len(INDEX_LEVELS) * 2
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def index_path(zero_datetime=None):
+	"""Returns the default index file path for a zero datetime"""
+	if zero_datetime is None:
+		zero_datetime = constants.ZERO_DATETIME
+	return os.path.join(constants.INDEX_DIR, f"timeline_{zero_datetime:%Y%m%dT%H%M%S%f}.idx")
+
+
+def build_index(hexagram_calculator, start, end, zero_datetime=None, path=None, verify_samples=1000):
+	"""
+	Writes the level 2-6 timeline between two datetimes to an index file
+	Args:
+		hexagram_calculator: Calculator used to walk the transitions
+		start: First datetime covered by the index
+		end: End of the index (exclusive)
+		zero_datetime: Zero datetime to index, defaults to constants.ZERO_DATETIME
+		path: Output path, defaults to index_path(zero_datetime)
+		verify_samples: Number of random times checked against get_hexagrams
+	Returns:
+		The path written
+	"""
+	if zero_datetime is None:
+		zero_datetime = constants.ZERO_DATETIME
+	if path is None:
+		path = index_path(zero_datetime)
+	if start >= end:
+		raise ValueError(f"Empty index window: {start} to {end}")
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+	temp_path = path + '.tmp'
+	try:
+		times = array.array('q')
+		count = 0
+		with open(temp_path, 'wb') as index_file, tempfile.TemporaryFile() as rows_file:
+			index_file.write(HEADER.pack(INDEX_MAGIC, 0, 0, 0, 0))
+
+			transitions = hexagram_calculator.iter_transitions(start, end, levels=[2], zero_datetime=zero_datetime)
+			record_times = itertools.chain([start], (timestamp for timestamp, *_ in transitions))
+			for timestamp in record_times:
+				levels = hexagram_calculator.get_levels(hexagram_calculator.to_ticks(zero_datetime - timestamp))
+				row = bytearray()
+				for level in INDEX_LEVELS:
+					hexagram_number, moving_line, _ = levels[level - 1]
+					row.append(hexagram_number)
+					row.append(moving_line)
+				rows_file.write(row)
+				times.append((timestamp - zero_datetime) // ONE_MICROSECOND)
+				count += 1
+				if len(times) >= 65536:
+					times.tofile(index_file)
+					del times[:]
+
+			times.tofile(index_file)
+			rows_file.seek(0)
+			shutil.copyfileobj(rows_file, index_file)
+
+			index_file.seek(0)
+			index_file.write(HEADER.pack(
+				INDEX_MAGIC,
+				(zero_datetime - datetime.datetime.min) // ONE_MICROSECOND,
+				(start - zero_datetime) // ONE_MICROSECOND,
+				(end - zero_datetime) // ONE_MICROSECOND,
+				count
+			))
+
+		with TimelineIndex(temp_path) as index:
+			if not index.verify(hexagram_calculator, verify_samples):
+				raise ValueError("Timeline index does not match get_hexagrams")
+		os.replace(temp_path, path)
+	finally:
+		# Only left over when writing or verifying failed
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+	return path
+
+
+class TimelineIndex:
+	"""Memory-mapped, read-only view of an index written by build_index"""
+	def __init__(self, path=None):
+		if path is None:
+			path = index_path()
+		self.path = path
+		self.file = open(path, 'rb')
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, zero_microseconds, self.start_offset, self.end_offset, self.count = HEADER.unpack_from(self.map, 0)
+		if magic != INDEX_MAGIC:
+			self.close()
+			raise ValueError(f"Not a timeline index: {path}")
+		self.zero_datetime = datetime.datetime.min + datetime.timedelta(microseconds=zero_microseconds)
+		self.start = self.zero_datetime + datetime.timedelta(microseconds=self.start_offset)
+		self.end = self.zero_datetime + datetime.timedelta(microseconds=self.end_offset)
+
+		times_end = HEADER.size + self.count * 8
+		self.view = memoryview(self.map)
+		self.times = self.view[HEADER.size:times_end].cast('q')
+		self.rows = self.view[times_end:times_end + self.count * ROW_SIZE]
+
+	def find_record(self, when):
+		"""Returns the number of the record active at a datetime"""
+		offset = (when - self.zero_datetime) // ONE_MICROSECOND
+		if not self.start_offset <= offset < self.end_offset:
+			raise ValueError(f"{when} is outside the index ({self.start} to {self.end})")
+		return bisect.bisect_right(self.times, offset) - 1
+
+	def cell(self, number, level):
+		"""Returns the position of a level's hexagram number in the rows, its moving line follows it"""
+		if level not in INDEX_LEVELS:
+			raise ValueError(f"Level {level} is not in the index (levels {INDEX_LEVELS.start}-{INDEX_LEVELS.stop - 1})")
+		return number * ROW_SIZE + 2 * (level - INDEX_LEVELS.start)
+
+	def hexagram(self, number, level):
+		"""Returns the hexagram number of a level in a record, read straight from the map"""
+		return self.rows[self.cell(number, level)]
+
+	def moving_line(self, number, level):
+		"""Returns the moving line of a level in a record, read straight from the map"""
+		return self.rows[self.cell(number, level) + 1]
+
+	def record(self, number):
+		"""
+		Returns ((level, hexagram_number, moving_line), ...) for levels 2-6 of a
+		record. Use hexagram and moving_line to read single levels without
+		building the tuple.
+		"""
+		row = number * ROW_SIZE
+		rows = self.rows
+		return tuple(
+			(level, rows[row + 2 * i], rows[row + 2 * i + 1])
+			for i, level in enumerate(INDEX_LEVELS)
+		)
+
+	def lookup(self, when):
+		"""Returns the level 2-6 hexagrams and moving lines active at a datetime"""
+		return self.record(self.find_record(when))
+
+	def scan(self, start, end):
+		"""
+		Yields (timestamp, record) for the state at start and every change before end
+		"""
+		number = self.find_record(start)
+		end_offset = (end - self.zero_datetime) // ONE_MICROSECOND
+		yield start, self.record(number)
+		number += 1
+		while number < self.count and self.times[number] < end_offset:
+			yield self.zero_datetime + datetime.timedelta(microseconds=self.times[number]), self.record(number)
+			number += 1
+
+	def verify(self, hexagram_calculator, samples=1000):
+		"""Checks random times and both sides of random record boundaries against get_hexagrams"""
+		span = self.end_offset - self.start_offset
+		offsets = [self.start_offset + random.randrange(span) for _ in range(samples)]
+		for number in random.sample(range(1, self.count), min(samples, self.count - 1)):
+			offsets.extend((self.times[number] - 1, self.times[number]))
+
+		for offset in offsets:
+			when = self.zero_datetime + datetime.timedelta(microseconds=offset)
+			hexagrams = hexagram_calculator.get_hexagrams(self.zero_datetime - when)
+			number = self.find_record(when)
+			for level in INDEX_LEVELS:
+				reading = hexagrams[level]
+				if self.hexagram(number, level) != reading.hexagram_number or self.moving_line(number, level) != reading.moving_line:
+					return False
+		return True
+
+	def close(self):
+		if getattr(self, 'view', None) is not None:
+			self.times.release()
+			self.rows.release()
+			self.view.release()
+			self.view = self.times = self.rows = None
+		self.map.close()
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+if __name__ == "__main__":
+	from hexagram_calculator import HexagramCalculator
+
+	parser = argparse.ArgumentParser(description="Build a timeline index for a zero date")
+	parser.add_argument('start', help="First date covered (YYYY-MM-DD)")
+	parser.add_argument('end', help="End date, exclusive (YYYY-MM-DD)")
+	parser.add_argument('--zero-date', help="Zero date (YYYY-MM-DD), defaults to constants.ZERO_DATETIME")
+	parser.add_argument('--output', help="Index file path")
+	args = parser.parse_args()
+
+	zero_datetime = datetime.datetime.strptime(args.zero_date, '%Y-%m-%d') if args.zero_date else None
+	path = build_index(
+		HexagramCalculator(),
+		datetime.datetime.strptime(args.start, '%Y-%m-%d'),
+		datetime.datetime.strptime(args.end, '%Y-%m-%d'),
+		zero_datetime,
+		args.output
+	)
+	print(f"Wrote {path}")
@@ -1,73 +1,364 @@
-import datetime
-from pythonosc import udp_client
+import collections
+import socket
+import struct
+import threading
+import time
+from pythonosc import osc_message_builder
 import constants
+import message_formatter
+
+
+class TokenBucket:
+	"""Allows rate sends per second on average, with bursts of up to capacity sends"""
+	def __init__(self, rate, capacity):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def delay(self):
+		"""Returns the seconds until a token is available, 0 if one is available now"""
+		self.refill()
+		if self.tokens >= 1:
+			return 0
+		return (1 - self.tokens) / self.rate
+
+	def consume(self):
+		self.tokens -= 1
+
+
+class CachedOSCClient:
+	"""
+	OSC client with the same send_message interface as SimpleUDPClient that
+	keeps the encoded datagrams of recent messages in an LRU cache and writes
+	them to one reused UDP socket
+	"""
+	def __init__(self, address, port, max_entries=None):
+		self.max_entries = constants.OSC_PACKET_CACHE_SIZE if max_entries is None else max_entries
+		self.datagrams = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		# The chatbox sender thread and the avatar parameter loop share the cache
+		self.lock = threading.Lock()
+		family, socket_type, protocol, _, socket_address = socket.getaddrinfo(address, port, type=socket.SOCK_DGRAM)[0]
+		# Resolve the address once instead of on every send
+		self.socket_address = socket_address
+		self.socket = socket.socket(family, socket_type, protocol)
+
+	def resolve(self, address, port):
+		"""Returns the socket address of another target reachable from this socket"""
+		return socket.getaddrinfo(address, port, family=self.socket.family, type=socket.SOCK_DGRAM)[0][4]
+
+	def encode(self, address, value, cache=True):
+		"""
+		Returns the datagram for a message, building it only on a cache miss
+		Args:
+			address: OSC address
+			value: List of message arguments
+			cache: False for values that rarely repeat, so they do not evict others
+		"""
+		key = (address, tuple(value))
+		with self.lock:
+			datagram = self.datagrams.get(key)
+			if datagram is not None:
+				self.datagrams.move_to_end(key)
+				self.hits += 1
+				return datagram
+			self.misses += 1
+
+		builder = osc_message_builder.OscMessageBuilder(address=address)
+		for argument in value:
+			builder.add_arg(argument)
+		datagram = builder.build().dgram
+		if not cache:
+			return datagram
+		with self.lock:
+			self.datagrams[key] = datagram
+			if len(self.datagrams) > self.max_entries:
+				self.datagrams.popitem(last=False)
+		return datagram
+
+	def send_message(self, address, value):
+		self.socket.sendto(self.encode(address, value), self.socket_address)
+
+	def send_batch(self, datagrams):
+		"""
+		Sends (datagram, socket_address) pairs back to back without blocking
+		Returns:
+			One entry per pair, None if it was sent or the exception if not
+		"""
+		self.socket.setblocking(False)
+		results = []
+		for datagram, socket_address in datagrams:
+			try:
+				self.socket.sendto(datagram, socket_address)
+				results.append(None)
+			except OSError as e:
+				# Includes BlockingIOError when the send buffer is full
+				results.append(e)
+		return results
+
+	def stats(self):
+		with self.lock:
+			return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.datagrams)}
+
+	def close(self):
+		self.socket.close()
+
+
+class OSCTarget:
+	"""One chatbox destination with its own page, rate limit and latest-wins slot"""
+	def __init__(self, client, ip, port, page=None, rate=None, burst=None):
+		self.name = f"{ip}:{port}"
+		self.socket_address = client.resolve(ip, port)
+		self.page = page
+		self.bucket = TokenBucket(
+			constants.VRCHAT_SEND_RATE if rate is None else rate,
+			constants.VRCHAT_SEND_BURST if burst is None else burst
+		)
+		self.pending = None
+		self.last_sent = None
+		self.counters = {'submitted': 0, 'sent': 0, 'deduplicated': 0, 'dropped': 0, 'errors': 0}
+		self.last_error = None
+
+	def current_page(self):
+		"""Returns the page this target shows, following constants.CURRENT_PAGE if not fixed"""
+		return constants.CURRENT_PAGE if self.page is None else self.page
+
+	def submit(self, message):
+		self.counters['submitted'] += 1
+		if self.pending is not None:
+			# Latest wins, the waiting message is out of date
+			self.counters['dropped'] += 1
+			self.pending = None
+		if message == self.last_sent:
+			self.counters['deduplicated'] += 1
+			return
+		self.pending = message
+
+
+class OSCSender:
+	"""
+	Sends chatbox messages to every target from one dedicated thread. Each
+	target keeps only its newest waiting message, skips a message equal to
+	the last one it was sent, and is rate limited by its own token bucket.
+	"""
+	def __init__(self, client, targets):
+		self.client = client
+		self.targets = targets
+		self.closed = False
+		self.condition = threading.Condition()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def pages(self):
+		"""Returns the pages currently shown by at least one target"""
+		return {target.current_page() for target in self.targets}
+
+	def submit(self, messages):
+		"""
+		Queues messages without blocking, replacing any message still waiting
+		Args:
+			messages: Dictionary of page number to formatted message
+		"""
+		with self.condition:
+			for target in self.targets:
+				message = messages.get(target.current_page())
+				if message is not None:
+					target.submit(message)
+			self.condition.notify()
+
+	def take_ready(self):
+		"""Returns the targets allowed to send now, and the seconds until the next one otherwise"""
+		ready = []
+		delay = None
+		for target in self.targets:
+			if target.pending is None:
+				continue
+			target_delay = target.bucket.delay()
+			if target_delay > 0:
+				delay = target_delay if delay is None else min(delay, target_delay)
+				continue
+			target.bucket.consume()
+			ready.append((target, target.pending))
+			target.pending = None
+		return ready, delay
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.closed and all(target.pending is None for target in self.targets):
+					self.condition.wait()
+				if self.closed:
+					return
+				ready, delay = self.take_ready()
+				if not ready:
+					# Wake early if closed; newer messages may replace these meanwhile
+					self.condition.wait(delay)
+					continue
+
+			# Targets showing the same page share one encoded datagram
+			results = self.client.send_batch([
+				(self.client.encode("/chatbox/input", [message, True, False]), target.socket_address)
+				for target, message in ready
+			])
+
+			with self.condition:
+				for (target, message), error in zip(ready, results):
+					if error is None:
+						target.counters['sent'] += 1
+						target.last_sent = message
+					else:
+						target.counters['errors'] += 1
+						target.last_error = str(error)
+
+	def stats(self):
+		"""
+		Returns the message counters summed over all targets, and per target in
+		VRCHAT_TARGETS order, since several targets may share an address
+		"""
+		with self.condition:
+			stats = {name: 0 for name in self.targets[0].counters} if self.targets else {}
+			stats['targets'] = []
+			for target in self.targets:
+				for name, value in target.counters.items():
+					stats[name] += value
+				target_stats = {'address': target.name, 'page': target.current_page()}
+				target_stats.update(target.counters)
+				target_stats['last_error'] = target.last_error
+				stats['targets'].append(target_stats)
+			return stats
+
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		self.thread.join()
+
+
+class AvatarParameterSender:
+	"""
+	Sends the hexagram number, moving line and phase of each level as avatar
+	parameters, bundling only the values that changed since the last send
+	"""
+	# Bundle header: "#bundle" and the "immediately" time tag
+	BUNDLE_HEADER = b'#bundle\0' + struct.pack('>Q', 1)
+
+	def __init__(self, client, socket_addresses, levels=None, keepalive=None):
+		self.client = client
+		self.socket_addresses = socket_addresses
+		self.levels = constants.AVATAR_PARAMETER_LEVELS if levels is None else levels
+		self.keepalive = constants.AVATAR_PARAMETER_KEEPALIVE if keepalive is None else keepalive
+		self.last_values = {}
+		self.last_full_send = None
+		self.counters = {'bundles': 0, 'parameters': 0, 'bytes': 0, 'errors': 0}
+
+	def parameter_values(self, hexagrams):
+		"""Returns {address: value} for every parameter of the configured levels"""
+		prefix = constants.AVATAR_PARAMETER_PREFIX
+		values = {}
+		for level in self.levels:
+			reading = hexagrams[level]
+			# Progress towards the next hexagram change, in VRChat's 8-bit float steps
+			phase = 1 - reading.time_to_next_change / reading.cycle_length.total_seconds()
+			values[f"{prefix}L{level}"] = reading.hexagram_number
+			values[f"{prefix}L{level}Line"] = reading.moving_line
+			values[f"{prefix}L{level}Phase"] = round(min(max(phase, 0), 1) * 255) / 255
+		return values
+
+	def send(self, hexagrams):
+		"""
+		Sends one bundle with the parameters that changed, or with all of them
+		when the keepalive interval has passed
+		Returns:
+			Number of parameters sent, 0 if no target could be reached
+		"""
+		values = self.parameter_values(hexagrams)
+		now = time.monotonic()
+		full_send = self.last_full_send is None or (self.keepalive and now - self.last_full_send >= self.keepalive)
+		if full_send:
+			changed = values
+		else:
+			changed = {address: value for address, value in values.items() if self.last_values.get(address) != value}
+		if not changed:
+			return 0
+
+		bundle = bytearray(self.BUNDLE_HEADER)
+		for address, value in changed.items():
+			datagram = self.client.encode(address, [value], cache=not isinstance(value, float))
+			bundle += struct.pack('>i', len(datagram))
+			bundle += datagram
+		bundle = bytes(bundle)
+
+		results = self.client.send_batch([(bundle, socket_address) for socket_address in self.socket_addresses])
+		sent = False
+		for error in results:
+			if error is None:
+				sent = True
+				self.counters['bundles'] += 1
+				self.counters['parameters'] += len(changed)
+				self.counters['bytes'] += len(bundle)
+			else:
+				self.counters['errors'] += 1
+		if not sent:
+			# Nothing arrived, so the same values are sent again next time
+			return 0
+		self.last_values.update(changed)
+		if full_send:
+			self.last_full_send = now
+		return len(changed)
+
+	def stats(self):
+		return dict(self.counters)
+
 
 class VRChatManager:
-	def __init__(self):
-		self.client = udp_client.SimpleUDPClient(constants.VRCHAT_IP, constants.VRCHAT_PORT)
+	def __init__(self, hexagram_calculator):
+		self.hexagram_calculator = hexagram_calculator
+		self.client = CachedOSCClient(constants.VRCHAT_IP, constants.VRCHAT_PORT)
+		targets = [OSCTarget(self.client, **target) for target in constants.VRCHAT_TARGETS]
+		self.sender = OSCSender(self.client, targets)
+		self.parameter_sender = AvatarParameterSender(self.client, [target.socket_address for target in targets])
+
+	def pages(self):
+		return self.sender.pages()
+
+	def page_levels(self, page):
+		"""Returns the levels a chatbox page shows, read from its current layout"""
+		return message_formatter.get_layout(f'page{page}', self.hexagram_calculator.cycles).levels
+
+	def format_page(self, page, hexagrams, time_to_zero):
+		return message_formatter.get_layout(f'page{page}', self.hexagram_calculator.cycles).render(hexagrams, time_to_zero)
 
-	def send_message(self, message):
+	def send_pages(self, messages):
+		"""Sends each target the message for its page, see OSCSender.submit"""
 		if not constants.SEND_TO_VRCHAT_ENABLED:
 			return
-		
-		try:
-			self.client.send_message("/chatbox/input", [message, True, False])
-			print("Message sent to VRChat")
-		except Exception as e:
-			print("Error sending message to VRChat:", e)
+		self.sender.submit(messages)
+
+	def send_parameters(self, hexagrams):
+		"""Sends the changed avatar parameters to every target, see AvatarParameterSender.send"""
+		if not constants.SEND_TO_VRCHAT_ENABLED:
+			return 0
+		return self.parameter_sender.send(hexagrams)
+
+	def stats(self):
+		stats = self.sender.stats()
+		stats['avatar_parameters'] = self.parameter_sender.stats()
+		stats['packet_cache'] = self.client.stats()
+		return stats
+
+	def cleanup(self):
+		self.sender.close()
+		self.client.close()
 
 	def format_message_page1(self, hexagrams, time_to_zero):
-		current_date = datetime.datetime.now().date()
-		days_to_zero = round(time_to_zero.total_seconds() / 86400)
-		hours_to_zero = int((time_to_zero.total_seconds() % 86400) // 3600)
-		
-		message = f"Date: {current_date}\nDays_to_0: {days_to_zero}d{hours_to_zero}h\n"
-		
-		for level, cycle_length, cycle_name, hexagram_number, hexagram_name, time_since_last_change in hexagrams:
-			if level in [1, 2]:
-				continue
-				
-			hexagram_first_name = hexagram_name.split(" - ")[0]
-			moving_line = (time_since_last_change // (cycle_length.total_seconds() / 6)) + 1
-
-			if level == 3:
-				time_to_next_change = datetime.timedelta(seconds=time_since_last_change) - cycle_length
-				time_time = (cycle_length - abs(time_to_next_change))
-				hours = int(abs(time_time.seconds // 3600))
-				minutes = int(abs((time_time.seconds % 3600) // 60))
-				seconds = int(abs(time_time.seconds % 60))
-				message += f"Change: {hours:02d}:{minutes:02d}:{seconds:02d}\n"
-				cycle_length_str = f"{cycle_length.total_seconds() / 3600:.2f}"
-				message += f"L {level}: {cycle_length_str} {cycle_name}, {hexagram_number}-{hexagram_first_name} - {moving_line}\n"
-			elif level in [4, 5]:
-				days = cycle_length.total_seconds() / 86400
-				message += f"L {level}: {days:.0f} d, {hexagram_number}-{hexagram_first_name} - {moving_line}\n"
-
-		return message
+		return message_formatter.get_layout('page1', self.hexagram_calculator.cycles).render(hexagrams, time_to_zero)
 
 	def format_message_page2(self, hexagrams, time_to_zero):
-		message = ""
-		for level, cycle_length, _cycle_name, hexagram_number, hexagram_name, time_since_last_change in hexagrams:
-			if level > 3:
-				continue
-				
-			hexagram_first_name = hexagram_name.split(" - ")[0]
-			moving_line = (time_since_last_change // (cycle_length.total_seconds() / 6)) + 1
-
-			if level == 1:
-				cycle_length_str = f"{cycle_length.total_seconds():.2f}"
-				message += f"L {level}: {cycle_length_str} s, {hexagram_number} - {hexagram_first_name}\n"
-			elif level == 2:
-				minutes = int(abs(time_since_last_change // 60))
-				seconds = int(abs(time_since_last_change % 60))
-				message += f"L 2 change {minutes:02d}:{seconds:02d}\n"
-				message += f"L {level}: {cycle_length.total_seconds():.2f} s, {hexagram_number} - {hexagram_first_name} - {moving_line}\n"
-			elif level == 3:
-				hours = int(abs(time_since_last_change // 3600))
-				minutes = int(abs((time_since_last_change % 3600) // 60))
-				seconds = int(abs(time_since_last_change % 60))
-				message += f"L 3 change {hours:02d}:{minutes:02d}:{seconds:02d}\n"
-				cycle_length_str = f"{cycle_length.total_seconds() / 3600:.2f}"
-				message += f"L {level}: {cycle_length_str} h, {hexagram_number} - {hexagram_first_name} - {moving_line}\n"
-
-		return message
\ No newline at end of file
+		return message_formatter.get_layout('page2', self.hexagram_calculator.cycles).render(hexagrams, time_to_zero)
\ No newline at end of file